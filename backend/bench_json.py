@@ -0,0 +1,65 @@
+"""
+Micro-benchmark for list response serialization:
+`python bench_json.py [--rows 1000] [--repeat 200]`
+
+"model" is what FastAPI does for a response_model endpoint fed ORM rows:
+validate each row into MatchResponse (from_attributes), dump to JSON-able
+python, then json.dumps. "fast" is the fastjson path /matches and the
+friends list use: column tuples zipped to dicts and encoded directly.
+No database needed; rows are built in memory.
+"""
+import time
+import argparse
+from datetime import datetime, timedelta
+from typing import List
+
+from pydantic import TypeAdapter
+from starlette.responses import JSONResponse
+
+import models
+import schemas
+import crud
+import fastjson
+
+
+def make_rows(n: int):
+    now = datetime.utcnow().replace(microsecond=0)
+    tuples = []
+    for i in range(n):
+        p1, p2 = f"#P{i % 50:04d}", f"#Q{i % 37:04d}"
+        tuples.append((f"{1700000000 + i}-{p1[1:]}-{p2[1:]}", p1, p2, p1 if i % 3 else None,
+                       now - timedelta(minutes=i), "PvP", i % 4, (i + 1) % 4, i + 1))
+    objects = [models.Match(**dict(zip(crud.MATCH_FIELDS + ("id",), t))) for t in tuples]
+    return tuples, objects
+
+
+def per_1k(fn, n: int, repeat: int) -> float:
+    fn() # warm up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat * 1000 / n * 1000 # ms per 1k rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    tuples, objects = make_rows(args.rows)
+    adapter = TypeAdapter(List[schemas.MatchResponse])
+
+    def model_path():
+        value = adapter.validate_python(objects, from_attributes=True)
+        return JSONResponse(adapter.dump_python(value, mode="json")).body
+
+    def fast_path():
+        return fastjson.dumps(fastjson.records(tuples, crud.MATCH_FIELDS))
+
+    assert model_path() == fast_path(), "fast path output differs"
+    before = per_1k(model_path, args.rows, args.repeat)
+    after = per_1k(fast_path, args.rows, args.repeat)
+    print(f"📊 {args.rows} rows x {args.repeat}, encoder={fastjson.ENCODER}")
+    print(f"   model (response_model): {before:.2f} ms / 1k rows")
+    print(f"   fast  (tuples + {fastjson.ENCODER}): {after:.2f} ms / 1k rows  ({before / after:.1f}x)")
@@ -0,0 +1,125 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Async read-through cache with LRU eviction.
+
+    - fresh for `ttl` seconds, then served stale for up to `stale_ttl` more
+      while one background refresh runs
+    - `None` results (unknown keys) are cached for `negative_ttl`
+    - concurrent misses for the same key share one `loader` call
+    """
+    def __init__(self, loader, ttl: float, stale_ttl: float, negative_ttl: float, max_size: int):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.entries = OrderedDict() # key -> (value, fetched_at)
+        self.inflight = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "negative_hits": 0, "misses": 0,
+                      "coalesced": 0, "refreshes": 0, "errors": 0, "evictions": 0}
+
+    def _age(self, key):
+        value, fetched_at = self.entries[key]
+        return value, time.monotonic() - fetched_at
+
+    def peek(self, key):
+        """Cached value without touching upstream, however stale."""
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def _store(self, key, value):
+        self.entries[key] = (value, time.monotonic())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def _load(self, key):
+        try:
+            value = await self.loader(key)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        self._store(key, value)
+        return value
+
+    def _start(self, key) -> asyncio.Task:
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key))
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self.inflight.pop(key, None))
+        return task
+
+    async def get(self, key):
+        if key in self.entries:
+            value, age = self._age(key)
+            self.entries.move_to_end(key)
+            if value is None:
+                if age < self.negative_ttl:
+                    self.stats["negative_hits"] += 1
+                    return None
+            elif age < self.ttl:
+                self.stats["hits"] += 1
+                return value
+            elif age < self.ttl + self.stale_ttl:
+                self.stats["stale_hits"] += 1
+                if key not in self.inflight:
+                    self.stats["refreshes"] += 1
+                    # Background refresh; errors just leave the stale copy in place
+                    self._start(key).add_done_callback(lambda t: t.cancelled() or t.exception())
+                return value
+
+        if key in self.inflight:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+        # Shield so one cancelled caller doesn't cancel the load for everyone else
+        return await asyncio.shield(self._start(key))
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "size": len(self.entries), "inflight": len(self.inflight)}
+
+
+class ExpiringDict:
+    """
+    Thread-safe LRU dict whose entries expire `ttl` seconds after being set.
+    For small in-process caches read from both the loop and worker threads.
+    """
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict() # key -> (value, expires_at)
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "size": len(self.entries)}
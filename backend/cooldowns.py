@@ -0,0 +1,56 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import models
+import database
+
+# --- Configuration ---
+# "memory" is per process; use "db" when running several workers/replicas
+COOLDOWN_BACKEND = os.getenv("COOLDOWN_BACKEND", "memory")
+
+
+class MemoryCooldowns:
+    def __init__(self):
+        self.last = {}
+        self.lock = threading.Lock()
+
+    def claim(self, key: str, seconds: int) -> bool:
+        """True (and start a new cooldown) if `key` isn't cooling down."""
+        now = time.monotonic()
+        with self.lock:
+            last = self.last.get(key)
+            if last is not None and now - last < seconds:
+                return False
+            self.last[key] = now
+            return True
+
+
+class DatabaseCooldowns:
+    """Shared across processes via the sync_cooldowns table; one atomic upsert per claim."""
+    def claim(self, key: str, seconds: int) -> bool:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        insert = pg_insert if database.engine.dialect.name == "postgresql" else sqlite_insert
+        C = models.SyncCooldown
+        stmt = insert(C).values(key=key, last_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"last_at": stmt.excluded.last_at},
+            # Only take over a row whose cooldown has run out
+            where=C.last_at < now - timedelta(seconds=seconds),
+        ).returning(C.key)
+
+        db = database.SessionLocal()
+        try:
+            claimed = db.execute(stmt).first() is not None
+            db.commit()
+            return claimed
+        finally:
+            db.close()
+
+
+cooldowns = DatabaseCooldowns() if COOLDOWN_BACKEND == "db" else MemoryCooldowns()
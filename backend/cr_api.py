@@ -0,0 +1,382 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Optional
+
+import httpx
+
+import metrics
+from cache import TTLCache
+
+# --- Configuration ---
+CR_API_KEY = os.getenv("CR_API_KEY") or None
+API_BASE = os.getenv("CR_API_BASE", "https://proxy.royaleapi.dev/v1") # Point at stub_cr_api.py locally
+# Upstreams in preference order (e.g. the proxy, then a direct api.clashroyale.com key)
+CR_API_BASES = [b.strip().rstrip("/") for b in os.getenv("CR_API_BASES", API_BASE).split(",") if b.strip()]
+CR_API_TIMEOUT = float(os.getenv("CR_API_TIMEOUT", 10))
+CR_API_INTERACTIVE_TIMEOUT = float(os.getenv("CR_API_INTERACTIVE_TIMEOUT", 3))
+
+# Circuit breaker: consecutive failures that open an upstream, seconds before a trial request
+CR_BREAKER_THRESHOLD = int(os.getenv("CR_BREAKER_THRESHOLD", 5))
+CR_BREAKER_COOLDOWN = float(os.getenv("CR_BREAKER_COOLDOWN", 30))
+# Hedging for interactive lookups: a second request goes out once the first has
+# taken longer than this percentile of recent latencies
+CR_HEDGE_PERCENTILE = float(os.getenv("CR_HEDGE_PERCENTILE", 95))
+CR_HEDGE_MIN_DELAY = float(os.getenv("CR_HEDGE_MIN_DELAY", 0.05))
+CR_HEDGE_DEFAULT_DELAY = float(os.getenv("CR_HEDGE_DEFAULT_DELAY", 1.0))
+
+# Requests/second allowed by our CR API key, and how many may be spent at once.
+# Each process accounts for its own share: split the key's quota across workers.
+CR_API_RATE = float(os.getenv("CR_API_RATE", 10))
+CR_API_BURST = int(os.getenv("CR_API_BURST", 20))
+# Tokens background sync must leave for interactive lookups
+CR_API_INTERACTIVE_RESERVE = int(os.getenv("CR_API_INTERACTIVE_RESERVE", 5))
+# Pause used when a 429 carries no usable Retry-After
+CR_API_DEFAULT_BACKOFF = float(os.getenv("CR_API_DEFAULT_BACKOFF", 10))
+CR_API_MAX_CONNECTIONS = int(os.getenv("CR_API_MAX_CONNECTIONS", 20))
+
+# Player profile cache (seconds): fresh, then served stale while refreshing
+PLAYER_CACHE_TTL = int(os.getenv("PLAYER_CACHE_TTL", 600))
+PLAYER_CACHE_STALE_TTL = int(os.getenv("PLAYER_CACHE_STALE_TTL", 3600))
+PLAYER_CACHE_NEGATIVE_TTL = int(os.getenv("PLAYER_CACHE_NEGATIVE_TTL", 300))
+PLAYER_CACHE_SIZE = int(os.getenv("PLAYER_CACHE_SIZE", 5000))
+
+
+class CRApiError(Exception):
+    pass
+
+
+class RateLimited(CRApiError):
+    def __init__(self, retry_after: float):
+        super().__init__(f"rate limited, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitOpen(CRApiError):
+    pass
+
+
+# Budget priorities: user-facing lookups always go before background sync
+INTERACTIVE, BACKGROUND = 0, 1
+
+
+class ApiBudget:
+    """
+    Owns this process's share of the CR API key's request budget.
+
+    A token bucket refilling at `rate`/sec up to `capacity`. Background
+    callers never take the last `reserve` tokens and yield whenever an
+    interactive caller is waiting. A 429 empties the bucket and pauses
+    every caller until Retry-After has passed.
+    """
+    def __init__(self, rate: float, capacity: int, reserve: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.reserve = min(reserve, capacity - 1)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.statuses = {}
+        self.rate_limited = 0
+        self._cond = asyncio.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _delay(self, priority: int) -> float:
+        """0 if a token was taken, else how long to wait before re-checking."""
+        self._refill()
+        paused_for = self.paused_until - time.monotonic()
+        if paused_for > 0:
+            return paused_for
+        floor = self.reserve if priority == BACKGROUND else 0
+        if priority == BACKGROUND and self.waiting[INTERACTIVE]:
+            return 1 / self.rate
+        if self.tokens - 1 >= floor:
+            self.tokens -= 1
+            return 0
+        return (1 + floor - self.tokens) / self.rate
+
+    async def acquire(self, priority: int = INTERACTIVE, max_wait: float = None):
+        """Wait for a token. With `max_wait`, give up (RateLimited) rather than wait longer."""
+        deadline = time.monotonic() + max_wait if max_wait is not None else None
+        self.waiting[priority] += 1
+        try:
+            async with self._cond:
+                while True:
+                    delay = self._delay(priority)
+                    if delay <= 0:
+                        # Let yielded background waiters re-check
+                        self._cond.notify_all()
+                        return
+                    if deadline is not None and time.monotonic() + delay > deadline:
+                        raise RateLimited(max(delay, 1.0))
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+        finally:
+            self.waiting[priority] -= 1
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is free right now (used for hedges)."""
+        self._refill()
+        if self.paused_until > time.monotonic() or self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def record(self, status_code: int, retry_after: float = None):
+        self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+        if status_code == 429:
+            self.rate_limited += 1
+            self.tokens = 0
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def snapshot(self) -> dict:
+        self._refill()
+        return {
+            "tokens": round(self.tokens, 2),
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "interactive_reserve": self.reserve,
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 2),
+            "waiting_interactive": self.waiting[INTERACTIVE],
+            "waiting_background": self.waiting[BACKGROUND],
+            "rate_limited": self.rate_limited,
+            "statuses": dict(self.statuses),
+        }
+
+
+budget = ApiBudget(CR_API_RATE, CR_API_BURST, CR_API_INTERACTIVE_RESERVE)
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures; after `cooldown`
+    one trial request is let through (half_open) and decides which way it goes.
+    """
+    def __init__(self, name: str, threshold: int, cooldown: float):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial = False
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state, self.trial = "half_open", False
+        if self.state == "closed":
+            return True
+        if self.state == "half_open" and not self.trial:
+            self.trial = True
+            return True
+        return False
+
+    def success(self):
+        self.state, self.failures, self.trial = "closed", 0, False
+
+    def failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state != "open":
+                print(f"⚠️ Circuit open for {self.name} after {self.failures} failures")
+            self.state, self.opened_at, self.trial = "open", time.monotonic(), False
+
+    def abandon(self):
+        # A cancelled half-open trial (lost hedge race) proves nothing either way
+        self.trial = False
+
+
+class Upstream:
+    def __init__(self, base: str):
+        self.base = base
+        self.breaker = CircuitBreaker(base, CR_BREAKER_THRESHOLD, CR_BREAKER_COOLDOWN)
+        self.latencies = deque(maxlen=200)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def hedge_delay(self, timeout: float) -> float:
+        if len(self.latencies) < 20:
+            return min(CR_HEDGE_DEFAULT_DELAY, timeout)
+        return min(max(self.percentile(CR_HEDGE_PERCENTILE), CR_HEDGE_MIN_DELAY), timeout)
+
+    def snapshot(self) -> dict:
+        return {
+            "base": self.base,
+            "state": self.breaker.state,
+            "failures": self.breaker.failures,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
+
+
+upstreams = [Upstream(b) for b in CR_API_BASES]
+hedge_stats = {"hedged": 0, "hedge_wins": 0}
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    # One pooled client per process (all upstreams), created lazily inside the running loop
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {CR_API_KEY}"},
+            limits=httpx.Limits(max_connections=CR_API_MAX_CONNECTIONS, max_keepalive_connections=CR_API_MAX_CONNECTIONS),
+            timeout=CR_API_TIMEOUT,
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def quote_tag(tag: str) -> str:
+    return tag.replace("#", "%23")
+
+
+def _retry_after(resp: httpx.Response) -> float:
+    try:
+        return max(float(resp.headers.get("Retry-After", "")), 1.0)
+    except ValueError:
+        return CR_API_DEFAULT_BACKOFF
+
+
+def _pick(exclude: Upstream = None) -> Optional[Upstream]:
+    for up in upstreams:
+        if up is not exclude and up.breaker.allow():
+            return up
+    return None
+
+
+def _endpoint(path: str) -> str:
+    # Metric label without the tag: "/players/%23X/battlelog" -> "battlelog"
+    parts = path.strip("/").split("/")
+    if parts[0] == "players":
+        return "battlelog" if parts[-1] == "battlelog" else "player"
+    return "clan" if parts[0] == "clans" else parts[0]
+
+
+async def _attempt(up: Upstream, path: str, timeout: float) -> httpx.Response:
+    endpoint = _endpoint(path)
+    started = time.perf_counter()
+    try:
+        resp = await get_client().get(up.base + path, timeout=timeout)
+    except httpx.HTTPError as e:
+        up.breaker.failure()
+        metrics.cr_api_requests.inc(endpoint, "error")
+        raise CRApiError(f"{type(e).__name__} for {path}") from e
+    except asyncio.CancelledError:
+        up.breaker.abandon()
+        raise
+    elapsed = time.perf_counter() - started
+    up.latencies.append(elapsed)
+    metrics.cr_api_latency.observe(endpoint, value=elapsed)
+    metrics.cr_api_requests.inc(endpoint, resp.status_code)
+
+    if resp.status_code >= 500:
+        up.breaker.failure()
+    else:
+        up.breaker.success()
+
+    retry_after = _retry_after(resp) if resp.status_code == 429 else None
+    budget.record(resp.status_code, retry_after)
+    if resp.status_code == 429:
+        print(f"⚠️ CR API rate limited, pausing all callers for {retry_after:.0f}s")
+        raise RateLimited(retry_after)
+    if resp.status_code not in (200, 404):
+        raise CRApiError(f"{resp.status_code} for {path}")
+    return resp
+
+
+async def _hedged(primary: Upstream, path: str, timeout: float) -> httpx.Response:
+    """
+    Send to `primary`; if it hasn't answered within its recent p95, race a
+    second copy (next healthy upstream, else the same one) and take the
+    first good answer. A hedge only goes out if the budget has a token spare.
+    """
+    first = asyncio.create_task(_attempt(primary, path, timeout))
+    done, _ = await asyncio.wait({first}, timeout=primary.hedge_delay(timeout))
+    if done or not budget.try_acquire():
+        return await first
+
+    hedge_stats["hedged"] += 1
+    second_up = _pick(exclude=primary) or primary
+    second = asyncio.create_task(_attempt(second_up, path, timeout))
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        hedge_stats["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def request(path: str, priority: int = INTERACTIVE, timeout: float = None, hedge: bool = False) -> httpx.Response:
+    """
+    The only way out to the CR API: waits for budget, picks a healthy
+    upstream, sends (hedged if asked), and accounts for the response.
+    Returns 200/404 responses; raises CRApiError for everything else.
+    """
+    timeout = timeout or CR_API_TIMEOUT
+    # Interactive callers would rather fail fast than sit out a long 429 pause
+    await budget.acquire(priority, max_wait=timeout if priority == INTERACTIVE else None)
+    primary = _pick()
+    if primary is None:
+        raise CircuitOpen("all CR API upstreams are failing")
+    if hedge:
+        return await _hedged(primary, path, timeout)
+    return await _attempt(primary, path, timeout)
+
+
+async def get_battlelog(tag: str, priority: int = BACKGROUND) -> Optional[list]:
+    """Battlelog for `tag` (newest first), None if the tag doesn't exist."""
+    resp = await request(f"/players/{quote_tag(tag)}/battlelog", priority)
+    return resp.json() if resp.status_code == 200 else None
+
+
+async def get_player(tag: str, priority: int = INTERACTIVE) -> Optional[dict]:
+    """Profile for `tag`, None if the tag doesn't exist. Raises CRApiError otherwise."""
+    if priority == INTERACTIVE:
+        resp = await request(f"/players/{quote_tag(tag)}", INTERACTIVE, timeout=CR_API_INTERACTIVE_TIMEOUT, hedge=True)
+    else:
+        resp = await request(f"/players/{quote_tag(tag)}", priority)
+    return resp.json() if resp.status_code == 200 else None
+
+
+async def get_clan(tag: str, priority: int = BACKGROUND) -> Optional[dict]:
+    """Clan for `tag` including `memberList` (name/trophies of up to 50 members), None if it doesn't exist."""
+    resp = await request(f"/clans/{quote_tag(tag)}", priority)
+    return resp.json() if resp.status_code == 200 else None
+
+
+player_profiles = TTLCache(
+    get_player,
+    ttl=PLAYER_CACHE_TTL,
+    stale_ttl=PLAYER_CACHE_STALE_TTL,
+    negative_ttl=PLAYER_CACHE_NEGATIVE_TTL,
+    max_size=PLAYER_CACHE_SIZE,
+)
@@ -1,53 +1,382 @@
+import base64
+from datetime import datetime
+
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, desc
-from sqlalchemy.dialects.postgresql import insert as pg_insert
-import models, schemas
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import or_, and_, select, insert, update, delete, case, func, tuple_, union_all, literal_column, type_coerce, JSON, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert, aggregate_order_by
+import models
+
+# Rows per INSERT statement (keeps bind params well under Postgres' 65535 limit)
+UPSERT_CHUNK_SIZE = 1000
 
 # --- User Logic ---
 def get_user_by_tag(db: Session, player_tag: str):
     return db.query(models.User).filter(models.User.player_tag == player_tag).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    # Ensure tag is formatted correctly (uppercase, starts with #)
-    formatted_tag = user.player_tag.upper()
-    if not formatted_tag.startswith("#"):
-        formatted_tag = f"#{formatted_tag}"
-    
-    db_user = models.User(username=user.username, player_tag=formatted_tag)
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+def get_user_by_email(db: Session, email: str):
+    return db.query(models.User).filter(models.User.email == email).first()
+
+# Async twins for handlers running on the event loop (database.AsyncSessionLocal)
+async def fetch_user_by_tag(db: AsyncSession, player_tag: str):
+    return await db.scalar(select(models.User).where(models.User.player_tag == player_tag))
+
+async def fetch_user_by_email(db: AsyncSession, email: str):
+    return await db.scalar(select(models.User).where(models.User.email == email))
+
+async def are_friends(db: AsyncSession, user_id: int, other_id: int) -> bool:
+    F = models.Friendship
+    return await db.scalar(select(F.id).where(or_(
+        and_(F.user_id_1 == user_id, F.user_id_2 == other_id),
+        and_(F.user_id_1 == other_id, F.user_id_2 == user_id),
+    )).limit(1)) is not None
+
+async def get_friends(db: AsyncSession, user_id: int):
+    """Friends of `user_id` as USER_FIELDS tuples, in one join."""
+    F, U = models.Friendship, models.User
+    friend_id = case((F.user_id_1 == user_id, F.user_id_2), else_=F.user_id_1)
+    return (await db.execute(
+        select(*(getattr(U, f) for f in USER_FIELDS)).join(F, U.id == friend_id)
+        .where(or_(F.user_id_1 == user_id, F.user_id_2 == user_id))
+    )).all()
+
+async def fetch_versions(db: AsyncSession, user_id: int):
+    """(matches_version, friends_version) for the ETag checks, or None."""
+    U = models.User
+    return (await db.execute(select(U.matches_version, U.friends_version).where(U.id == user_id))).first()
+
+# --- Validators ---
+def bump_matches_version(db: Session, tags) -> None:
+    """New battles for any of `tags`. Does not commit."""
+    if tags:
+        U = models.User
+        db.execute(update(U).where(U.player_tag.in_(list(tags))).values(matches_version=U.matches_version + 1))
+
+def bump_friends_version(db: Session, user_ids=(), friends_of=()) -> None:
+    """
+    Friend lists changed for `user_ids`; profiles changed for `friends_of`,
+    which shows up on their own dashboard and on every friend's list.
+    Does not commit.
+    """
+    F, U = models.Friendship, models.User
+    ids = list(user_ids) + list(friends_of)
+    if not ids:
+        return
+    cond = U.id.in_(ids)
+    if friends_of:
+        friends_of = list(friends_of)
+        cond = or_(cond, U.id.in_(union_all(
+            select(F.user_id_2).where(F.user_id_1.in_(friends_of)),
+            select(F.user_id_1).where(F.user_id_2.in_(friends_of)),
+        )))
+    db.execute(update(U).where(cond).values(friends_version=U.friends_version + 1))
 
 # --- Match Logic ---
-def get_matches_for_player(db: Session, player_tag: str, limit: int = 50):
+# Columns of schemas.MatchResponse / UserResponse, in order, for tuple-based fast responses
+MATCH_FIELDS = ("battle_id", "player_1_tag", "player_2_tag", "winner_tag", "battle_time", "game_mode", "crowns_1", "crowns_2")
+USER_FIELDS = ("id", "email", "username", "player_tag", "trophies", "clan_name")
+
+def encode_cursor(match) -> str:
+    raw = f"{match.battle_time.isoformat()}|{match.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    """Inverse of encode_cursor. Raises ValueError on anything malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        battle_time, match_id = raw.split("|")
+        return datetime.fromisoformat(battle_time), int(match_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def matches_page_stmt(player_tag: str, limit: int = 50, cursor: str = None,
+                      opponent: str = None, game_mode: str = None):
     """
-    Optimized query to find matches where the player was EITHER 
-    player_1 OR player_2, sorted by most recent.
+    One page of a player's history, newest first, keyed on (battle_time, id).
+    Instead of OR-ing player_1/player_2 (which forces a bitmap scan + sort),
+    each side is a range scan on its own (tag, battle_time, id) index that
+    stops after `limit` rows, and the two short lists are merged.
     """
-    return db.query(models.Match).filter(
-        or_(
-            models.Match.player_1_tag == player_tag,
-            models.Match.player_2_tag == player_tag
-        )
-    ).order_by(desc(models.Match.battle_time)).limit(limit).all()
+    M = models.Match
+    after = decode_cursor(cursor) if cursor else None
+
+    def side(me_col, opp_col, skip_self=False):
+        # Only the response columns (+ id for the keyset), never the whole row
+        q = select(*(getattr(M, f) for f in MATCH_FIELDS), M.id).where(me_col == player_tag)
+        if skip_self:
+            # A self-match would otherwise show up on both sides
+            q = q.where(opp_col != player_tag)
+        if opponent:
+            q = q.where(opp_col == opponent)
+        if game_mode:
+            q = q.where(M.game_mode == game_mode)
+        if after:
+            q = q.where(tuple_(M.battle_time, M.id) < tuple_(*after))
+        return select(q.order_by(M.battle_time.desc(), M.id.desc()).limit(limit).subquery())
+
+    both = union_all(side(M.player_1_tag, M.player_2_tag), side(M.player_2_tag, M.player_1_tag, skip_self=True)).subquery()
+    return select(both).order_by(both.c.battle_time.desc(), both.c.id.desc()).limit(limit)
+
+def matches_export_stmt(player_tag: str, opponent: str = None, since: datetime = None, until: datetime = None):
+    """
+    A player's whole history, oldest first, optionally against one opponent
+    and within [since, until). Same two-sided shape as matches_page_stmt,
+    MATCH_FIELDS then id per row. Meant to be streamed, not loaded.
+    """
+    M = models.Match
+
+    def side(me_col, opp_col, skip_self=False):
+        q = select(*(getattr(M, f) for f in MATCH_FIELDS), M.id).where(me_col == player_tag)
+        if skip_self:
+            q = q.where(opp_col != player_tag)
+        if opponent:
+            q = q.where(opp_col == opponent)
+        if since:
+            q = q.where(M.battle_time >= since)
+        if until:
+            q = q.where(M.battle_time < until)
+        return q
+
+    both = union_all(side(M.player_1_tag, M.player_2_tag), side(M.player_2_tag, M.player_1_tag, skip_self=True)).subquery()
+    return select(both).order_by(both.c.battle_time, both.c.id)
+
+async def get_matches_for_player(db: AsyncSession, player_tag: str, limit: int = 50, cursor: str = None,
+                                 opponent: str = None, game_mode: str = None):
+    """
+    Returns (rows, next_cursor): MATCH_FIELDS then id per row. next_cursor is None on the last page.
+    """
+    matches = (await db.execute(matches_page_stmt(player_tag, limit, cursor, opponent, game_mode))).all()
+    next_cursor = encode_cursor(matches[-1]) if len(matches) == limit else None
+    return matches, next_cursor
+
+def upsert_matches(db: Session, matches_data: list[dict]) -> set[str]:
+    """
+    Bulk insert matches in multi-row statements. Ignores duplicates based on
+    the 'battle_id' unique constraint using PostgreSQL's ON CONFLICT DO NOTHING;
+    other dialects (SQLite in tests) filter existing IDs with one IN query first.
+    Returns the battle_ids actually inserted. Does not commit, so callers can
+    put follow-up writes in the same transaction.
+    """
+    # Collapse duplicates inside the batch itself (two friends report the same battle).
+    # battle_id order: workers inserting the same battles wait on each other in one order, never deadlock
+    by_id = {m["battle_id"]: m for m in matches_data}
+    rows = [by_id[k] for k in sorted(by_id)]
+    inserted = set()
+
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = rows[i:i + UPSERT_CHUNK_SIZE]
+
+        if db.bind.dialect.name == "postgresql":
+            stmt = pg_insert(models.Match).values(chunk)
+            # Define what to do on conflict (duplicate battle_id): do nothing
+            stmt = stmt.on_conflict_do_nothing(index_elements=['battle_id']).returning(models.Match.battle_id)
+            inserted.update(db.execute(stmt).scalars())
+        else:
+            ids = [m["battle_id"] for m in chunk]
+            existing = set(db.execute(select(models.Match.battle_id).where(models.Match.battle_id.in_(ids))).scalars())
+            fresh = [m for m in chunk if m["battle_id"] not in existing]
+            if fresh:
+                db.execute(insert(models.Match), fresh)
+            inserted.update(m["battle_id"] for m in fresh)
+
+    return inserted
+
+# --- Rivalry Logic ---
+def _empty_rivalry(a: str, b: str) -> dict:
+    return {"player_a_tag": a, "player_b_tag": b, "wins_a": 0, "wins_b": 0,
+            "draws": 0, "crowns_a": 0, "crowns_b": 0, "last_battle_time": None}
+
+def _fold_rivalry(acc: dict, p1: str, p2: str, wins_1: int, wins_2: int, draws: int,
+                  crowns_1: int, crowns_2: int, last_battle_time):
+    """Add player_1/player_2 oriented totals into the sorted-pair aggregate."""
+    a, b = sorted([p1, p2])
+    r = acc.setdefault((a, b), _empty_rivalry(a, b))
+    if a != p1:
+        wins_1, wins_2, crowns_1, crowns_2 = wins_2, wins_1, crowns_2, crowns_1
+    r["wins_a"] += wins_1
+    r["wins_b"] += wins_2
+    r["draws"] += draws
+    r["crowns_a"] += crowns_1
+    r["crowns_b"] += crowns_2
+    if last_battle_time and (r["last_battle_time"] is None or last_battle_time > r["last_battle_time"]):
+        r["last_battle_time"] = last_battle_time
 
-def upsert_matches(db: Session, matches_data: list[dict]):
+def apply_rivalry_deltas(db: Session, matches_data: list[dict]):
     """
-    Bulk insert matches. Ignores duplicates based on the 'battle_id' 
-    unique constraint using PostgreSQL's ON CONFLICT DO NOTHING.
+    Add newly inserted matches to the rivalries aggregate. Call in the same
+    transaction as upsert_matches, with only the rows it reported as inserted.
     """
-    if not matches_data:
+    acc = {}
+    for m in matches_data:
+        p1, p2, winner = m["player_1_tag"], m["player_2_tag"], m["winner_tag"]
+        _fold_rivalry(acc, p1, p2, int(winner == p1), int(winner == p2), int(winner is None),
+                      m["crowns_1"], m["crowns_2"], m["battle_time"])
+    if not acc:
         return
 
-    stmt = pg_insert(models.Match).values(matches_data)
-    
-    # Define what to do on conflict (duplicate battle_id): do nothing
-    do_nothing_stmt = stmt.on_conflict_do_nothing(
-        index_elements=['battle_id']
-    )
-    
-    db.execute(do_nothing_stmt)
+    R = models.Rivalry
+    # Key order, so concurrent flushes touching overlapping pairs lock rows in
+    # the same order and can't deadlock
+    deltas = [acc[k] for k in sorted(acc)]
+    if db.bind.dialect.name == "postgresql":
+        stmt = pg_insert(R).values(deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['player_a_tag', 'player_b_tag'],
+            set_={
+                "wins_a": R.wins_a + stmt.excluded.wins_a,
+                "wins_b": R.wins_b + stmt.excluded.wins_b,
+                "draws": R.draws + stmt.excluded.draws,
+                "crowns_a": R.crowns_a + stmt.excluded.crowns_a,
+                "crowns_b": R.crowns_b + stmt.excluded.crowns_b,
+                "last_battle_time": func.greatest(R.last_battle_time, stmt.excluded.last_battle_time),
+            },
+        )
+        db.execute(stmt)
+        return
+
+    existing = {
+        (r.player_a_tag, r.player_b_tag): r
+        for r in db.query(R).filter(tuple_(R.player_a_tag, R.player_b_tag).in_(list(acc.keys())))
+    }
+    for d in deltas:
+        r = existing.get((d["player_a_tag"], d["player_b_tag"]))
+        if r is None:
+            db.add(R(**d))
+            continue
+        for col in ("wins_a", "wins_b", "draws", "crowns_a", "crowns_b"):
+            setattr(r, col, getattr(r, col) + d[col])
+        # Stored values come back naive (UTC); sync hands us aware datetimes
+        latest = d["last_battle_time"].replace(tzinfo=None)
+        if r.last_battle_time is None or latest > r.last_battle_time:
+            r.last_battle_time = latest
+    db.flush()
+
+def rebuild_rivalries(db: Session) -> int:
+    """
+    Recompute the whole rivalries table from 'matches'. The heavy lifting is a
+    GROUP BY on the raw (player_1, player_2) order; folding the two orientations
+    of a pair happens in Python so tag ordering never depends on DB collation.
+    Commits; call it with no other work pending in `db`.
+    """
+    if db.bind.dialect.name == "postgresql":
+        # Hold off apply_rivalry_deltas until the rebuild commits: a delta landing
+        # between the aggregate read and the reinsert would be lost or double-counted.
+        # Writers whose matches we can't see yet wait here and apply on top afterwards.
+        db.execute(text("LOCK TABLE rivalries IN EXCLUSIVE MODE"))
+    M = models.Match
+    stmt = select(
+        M.player_1_tag, M.player_2_tag,
+        func.sum(case((M.winner_tag == M.player_1_tag, 1), else_=0)),
+        func.sum(case((M.winner_tag == M.player_2_tag, 1), else_=0)),
+        func.sum(case((M.winner_tag == None, 1), else_=0)),
+        func.sum(M.crowns_1), func.sum(M.crowns_2), func.max(M.battle_time),
+    ).group_by(M.player_1_tag, M.player_2_tag)
+
+    acc = {}
+    for p1, p2, w1, w2, draws, c1, c2, last in db.execute(stmt):
+        _fold_rivalry(acc, p1, p2, w1 or 0, w2 or 0, draws or 0, c1 or 0, c2 or 0, last)
+
+    db.execute(delete(models.Rivalry))
+    rows = list(acc.values())
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        db.execute(insert(models.Rivalry), rows[i:i + UPSERT_CHUNK_SIZE])
     db.commit()
+    return len(rows)
+
+async def get_h2h_standings(db: AsyncSession, user: models.User) -> list[dict]:
+    """
+    Every friend of `user` with the head-to-head record from `user`'s side,
+    in one query: friendships -> users -> rivalries (via the unique pair index).
+    """
+    F, U, R = models.Friendship, models.User, models.Rivalry
+    me = user.player_tag
+    friend_id = case((F.user_id_1 == user.id, F.user_id_2), else_=F.user_id_1)
+
+    rows = (await db.execute(
+        select(U.id, U.username, U.player_tag, U.trophies, R)
+        .select_from(F)
+        .join(U, U.id == friend_id)
+        .outerjoin(R, or_(
+            and_(R.player_a_tag == me, R.player_b_tag == U.player_tag),
+            and_(R.player_a_tag == U.player_tag, R.player_b_tag == me),
+        ))
+        .where(or_(F.user_id_1 == user.id, F.user_id_2 == user.id))
+    )).all()
+
+    standings = []
+    for uid, username, tag, trophies, r in rows:
+        s = {"user_id": uid, "username": username, "player_tag": tag, "trophies": trophies,
+             "wins": 0, "losses": 0, "draws": 0, "crowns": 0, "crowns_against": 0, "last_battle_time": None}
+        if r is not None:
+            mine_a = r.player_a_tag == me
+            s.update(
+                wins=r.wins_a if mine_a else r.wins_b,
+                losses=r.wins_b if mine_a else r.wins_a,
+                draws=r.draws,
+                crowns=r.crowns_a if mine_a else r.crowns_b,
+                crowns_against=r.crowns_b if mine_a else r.crowns_a,
+                last_battle_time=r.last_battle_time,
+            )
+        standings.append(s)
+    return sorted(standings, key=lambda s: s["wins"], reverse=True)
+
+# --- Dashboard ---
+def _json_rows(dialect: str, sub, order_by=()):
+    """JSON array of `sub`'s rows as objects, built in the database (NULL when empty)."""
+    pairs = []
+    for col in sub.c:
+        # Keys inlined: json_build_object's variadic args can't infer bind param types
+        pairs += [literal_column(f"'{col.name}'"), col]
+    if dialect == "postgresql":
+        obj = func.json_build_object(*pairs)
+        agg = func.json_agg(aggregate_order_by(obj, *order_by)) if order_by else func.json_agg(obj)
+    else:
+        # SQLite keeps the subquery's order
+        agg = func.json_group_array(func.json_object(*pairs))
+    return type_coerce(select(agg).select_from(sub).scalar_subquery(), JSON)
+
+async def get_dashboard(db: AsyncSession, user_id: int, player_tag: str, match_limit: int = 20) -> dict:
+    """
+    Profile, friends with head-to-head records, and recent matches in one
+    SELECT: each part is a subquery aggregated to JSON by the database.
+    The user's version counters come along, under "versions", for the ETag.
+    """
+    dialect = db.bind.dialect.name
+    F, U, R = models.Friendship, models.User, models.Rivalry
+    friend_id = case((F.user_id_1 == user_id, F.user_id_2), else_=F.user_id_1)
+    mine_a = R.player_a_tag == player_tag
+
+    profile = select(U.id, U.email, U.username, U.player_tag, U.trophies, U.clan_name).where(U.id == user_id).subquery("profile")
+    friends = (
+        select(
+            U.id.label("user_id"), U.username, U.player_tag, U.trophies,
+            func.coalesce(case((mine_a, R.wins_a), else_=R.wins_b), 0).label("wins"),
+            func.coalesce(case((mine_a, R.wins_b), else_=R.wins_a), 0).label("losses"),
+            func.coalesce(R.draws, 0).label("draws"),
+            func.coalesce(case((mine_a, R.crowns_a), else_=R.crowns_b), 0).label("crowns"),
+            func.coalesce(case((mine_a, R.crowns_b), else_=R.crowns_a), 0).label("crowns_against"),
+            R.last_battle_time,
+        )
+        .select_from(F)
+        .join(U, U.id == friend_id)
+        .outerjoin(R, or_(
+            and_(R.player_a_tag == player_tag, R.player_b_tag == U.player_tag),
+            and_(R.player_a_tag == U.player_tag, R.player_b_tag == player_tag),
+        ))
+        .where(or_(F.user_id_1 == user_id, F.user_id_2 == user_id))
+        .subquery("friends")
+    )
+    versions = [select(col).where(U.id == user_id).scalar_subquery() for col in (U.matches_version, U.friends_version)]
+    parts = [_json_rows(dialect, profile), _json_rows(dialect, friends), *versions]
+    if player_tag:
+        recent = matches_page_stmt(player_tag, match_limit).subquery("recent")
+        parts.append(_json_rows(dialect, recent, (recent.c.battle_time.desc(), recent.c.id.desc())))
 
-    
\ No newline at end of file
+    row = (await db.execute(select(*parts))).one()
+    standings = sorted(row[1] or [], key=lambda s: s["wins"], reverse=True)
+    return {
+        "profile": (row[0] or [None])[0],
+        "standings": standings,
+        "matches": (row[4] or []) if player_tag else [],
+        "versions": (row[2], row[3]), # (matches_version, friends_version)
+    }
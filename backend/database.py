@@ -1,6 +1,13 @@
 import os
-from sqlalchemy import create_engine
+import asyncio
+import itertools
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+import metrics
+import profiler
 
 # RAILWAY CONFIGURATION
 # 1. Tries to get the secure DATABASE_URL from Railway environment variables.
@@ -11,6 +18,181 @@ DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/cr_
 if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
     DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-engine = create_engine(DATABASE_URL)
+# Pool settings, per engine and per process (the async and sync engines each get one)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# asyncpg prepared statement cache per connection; set 0 behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+
+
+def async_url(url: str) -> str:
+    """Same database through an asyncio driver: asyncpg for Postgres, aiosqlite for local SQLite."""
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    if url.startswith("postgresql+psycopg2://"):
+        return url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    return url
+
+
+def pool_options(url: str) -> dict:
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE,
+    }
+
+
+engine = create_engine(DATABASE_URL, **pool_options(DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+# Read replicas (optional): comma-separated URLs. Read-only request handlers
+# use a healthy replica; writes and everything else stay on the primary.
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+# A replica further behind than this (seconds) is skipped until it catches up
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+REPLICA_CHECK_SECONDS = float(os.getenv("REPLICA_CHECK_SECONDS", 10))
+
+
+def make_async_engine(url: str, name: str):
+    url = async_url(url.replace("postgres://", "postgresql://", 1))
+    eng = create_async_engine(
+        url,
+        connect_args={"statement_cache_size": DB_STATEMENT_CACHE_SIZE} if "+asyncpg" in url else {},
+        **pool_options(url),
+    )
+    metrics.instrument_engine(eng.sync_engine, name)
+    if profiler.SQL_PROFILE:
+        profiler.instrument_engine(eng.sync_engine)
+    return eng
+
+
+# Async engine for request handlers that stay on the event loop
+async_engine = make_async_engine(DATABASE_URL, "async")
+# Don't expire on commit: handlers return ORM objects after committing, and
+# a lazy refresh would need IO outside an await
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+metrics.instrument_engine(engine, "sync")
+if profiler.SQL_PROFILE:
+    profiler.instrument_engine(engine)
+
+
+# Seconds since the last replayed transaction, or 0 when nothing is pending
+# (an idle primary would otherwise look like growing lag)
+LAG_SQL = text("""
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+class Replica:
+    def __init__(self, url: str, index: int):
+        self.url = url
+        self.engine = make_async_engine(url, f"replica{index}")
+        self.healthy = False # Until the first check passes
+        self.lag = None
+        self.error = None
+
+    async def check(self):
+        try:
+            async with self.engine.connect() as conn:
+                if self.engine.dialect.name == "postgresql":
+                    self.lag = float(await conn.scalar(LAG_SQL))
+                else:
+                    await conn.execute(text("SELECT 1"))
+                    self.lag = 0.0
+            self.error = None
+        except Exception as e:
+            self.lag, self.error = None, str(e)[:200]
+        healthy = self.lag is not None and self.lag <= REPLICA_MAX_LAG
+        if healthy != self.healthy:
+            print(f"{'✅' if healthy else '⚠️'} Replica {self.engine.url.host or self.url} "
+                  f"{'healthy' if healthy else 'unhealthy'} (lag={self.lag}, error={self.error})")
+        self.healthy = healthy
+
+    def snapshot(self) -> dict:
+        return {"host": self.engine.url.host, "healthy": self.healthy, "lag_seconds": self.lag, "error": self.error}
+
+
+replicas = [Replica(url, i) for i, url in enumerate(DATABASE_REPLICA_URLS)]
+_next_replica = itertools.count()
+
+
+def read_engine(primary: bool = False):
+    """Engine for a read-only session: a healthy replica (round robin), else the primary."""
+    healthy = [r for r in replicas if r.healthy]
+    if primary or not healthy:
+        return async_engine
+    return healthy[next(_next_replica) % len(healthy)].engine
+
+
+async def monitor_replicas():
+    while True:
+        await asyncio.gather(*(r.check() for r in replicas))
+        await asyncio.sleep(REPLICA_CHECK_SECONDS)
+
+
+def _invalid_indexes(conn) -> set:
+    """Postgres indexes left INVALID by an interrupted CONCURRENTLY build."""
+    return set(conn.execute(text(
+        "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE NOT i.indisvalid"
+    )).scalars())
+
+
+def add_missing_columns():
+    """
+    create_all() only creates missing tables, it never alters existing ones.
+    Add any model columns and indexes the live tables lack. Run from
+    migrate.py before processes start, not from every process.
+    On Postgres, indexes are built CONCURRENTLY (outside a transaction) so
+    writes to big tables like matches carry on during the build, and every
+    statement is IF NOT EXISTS in case two runs overlap.
+    Only nullable or server-defaulted columns can be added this way.
+    """
+    pg = engine.dialect.name == "postgresql"
+    insp = inspect(engine)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        invalid = _invalid_indexes(conn) if pg else set()
+        for table in Base.metadata.sorted_tables:
+            if not insp.has_table(table.name):
+                continue
+            existing = {c["name"] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = (f"ALTER TABLE {table.name} ADD COLUMN {'IF NOT EXISTS ' if pg else ''}"
+                       f"{col.name} {col.type.compile(dialect=engine.dialect)}")
+                if col.server_default is not None:
+                    ddl += f" DEFAULT {col.server_default.arg}"
+                    if not col.nullable:
+                        ddl += " NOT NULL" # Existing rows get the default, so this holds
+                print(f"🛠️  Adding column {table.name}.{col.name}")
+                conn.execute(text(ddl))
+
+            indexes = {i["name"] for i in insp.get_indexes(table.name)} - invalid
+            for idx in table.indexes:
+                if idx.name in indexes:
+                    continue
+                print(f"🛠️  Adding index {idx.name}")
+                if not pg:
+                    conn.execute(CreateIndex(idx, if_not_exists=True))
+                    continue
+                if idx.name in invalid:
+                    conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{idx.name}"'))
+                options = idx.dialect_options["postgresql"]
+                options["concurrently"] = True
+                try:
+                    conn.execute(CreateIndex(idx, if_not_exists=True))
+                finally:
+                    options["concurrently"] = False
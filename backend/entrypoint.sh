@@ -0,0 +1,8 @@
+#!/bin/sh
+# Migrate the schema, then run the container's command (API or worker).
+# MIGRATE_ON_START=0 skips it for deploys that run `python migrate.py` themselves.
+set -e
+if [ "${MIGRATE_ON_START:-1}" = "1" ]; then
+    python migrate.py
+fi
+exec "$@"
@@ -0,0 +1,173 @@
+"""
+Push of newly ingested battles to connected clients (GET /events, SSE).
+
+The sync writer calls notify() inside its flush transaction. On Postgres that
+is a NOTIFY, delivered on commit to every API process LISTENing on
+EVENTS_CHANNEL, so the worker can run in any process. Other databases (SQLite
+in dev) hand the events to this process's broker after commit, which only
+reaches clients when the writer runs in the API process (SYNC_IN_API=1).
+"""
+import os
+import json
+import asyncio
+from collections import defaultdict
+
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+import database
+import metrics
+
+# --- Configuration ---
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "clash_events")
+# Events buffered per connection before it's told to resync instead
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", 100))
+# Comment line sent on idle streams so proxies don't close them
+EVENTS_KEEPALIVE_SECONDS = int(os.getenv("EVENTS_KEEPALIVE_SECONDS", 15))
+EVENTS_RECONNECT_SECONDS = 5
+
+USE_NOTIFY = database.engine.dialect.name == "postgresql"
+PENDING = "pending_match_events" # Session.info key for the non-Postgres path
+
+
+def h2h_delta(match: dict, tag: str) -> dict:
+    """The battle as a change to `tag`'s head-to-head record against the opponent."""
+    mine = match["player_1_tag"] == tag
+    opponent = match["player_2_tag"] if mine else match["player_1_tag"]
+    return {
+        "opponent_tag": opponent,
+        "wins": int(match["winner_tag"] == tag),
+        "losses": int(match["winner_tag"] == opponent),
+        "draws": int(match["winner_tag"] is None),
+        "crowns": match["crowns_1"] if mine else match["crowns_2"],
+        "crowns_against": match["crowns_2"] if mine else match["crowns_1"],
+    }
+
+
+class Broker:
+    """Fans matches out to this process's /events connections, by player tag. Loop-only."""
+    def __init__(self):
+        self.subscribers = defaultdict(set) # player_tag -> {asyncio.Queue}
+        self.loop = None
+        self.stats = {"published": 0, "delivered": 0, "overflows": 0, "relay_errors": 0}
+
+    def subscribe(self, tag: str) -> asyncio.Queue:
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(EVENTS_QUEUE_SIZE)
+        self.subscribers[tag].add(queue)
+        return queue
+
+    def unsubscribe(self, tag: str, queue: asyncio.Queue):
+        subs = self.subscribers.get(tag)
+        if subs is not None:
+            subs.discard(queue)
+            if not subs:
+                del self.subscribers[tag]
+
+    def put(self, queue: asyncio.Queue, item: dict):
+        try:
+            queue.put_nowait(item)
+            self.stats["delivered"] += 1
+        except asyncio.QueueFull:
+            # Client isn't keeping up: drop its backlog and have it refetch once
+            self.stats["overflows"] += 1
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"type": "resync"})
+
+    def publish(self, match: dict):
+        self.stats["published"] += 1
+        metrics.events_published.inc("match")
+        for tag in (match["player_1_tag"], match["player_2_tag"]):
+            for queue in self.subscribers.get(tag, ()):
+                self.put(queue, {"type": "match", "match": match, "h2h": h2h_delta(match, tag)})
+
+    def publish_threadsafe(self, matches: list):
+        # The writer flushes from a worker thread; nobody can be listening before the first subscribe
+        if self.loop is None or self.loop.is_closed():
+            return
+        for m in matches:
+            self.loop.call_soon_threadsafe(self.publish, m)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "relay": "notify" if USE_NOTIFY else "in-process",
+            "subscribers": sum(len(s) for s in self.subscribers.values()),
+            "tags": len(self.subscribers),
+        }
+
+
+broker = Broker()
+
+
+def notify(db: Session, matches: list):
+    """Queue newly inserted match rows for push. Sent only if `db`'s transaction commits."""
+    if not matches:
+        return
+    payloads = [{**m, "battle_time": m["battle_time"].isoformat()} for m in matches]
+    if USE_NOTIFY:
+        # One NOTIFY per battle keeps each payload far below the 8000-byte limit
+        db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                   [{"channel": EVENTS_CHANNEL, "payload": json.dumps(p)} for p in payloads])
+    else:
+        db.info.setdefault(PENDING, []).extend(payloads)
+
+
+@event.listens_for(Session, "after_commit")
+def _deliver_pending(session):
+    pending = session.info.pop(PENDING, None)
+    if pending:
+        broker.publish_threadsafe(pending)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_pending(session):
+    session.info.pop(PENDING, None)
+
+
+async def listen():
+    """Relay NOTIFYs from every process's sync writer into this process's broker."""
+    broker.loop = asyncio.get_running_loop()
+
+    def on_notify(conn, pid, channel, payload):
+        try:
+            broker.publish(json.loads(payload))
+        except (ValueError, KeyError) as e:
+            print(f"Bad match event: {e}")
+
+    while True:
+        try:
+            async with database.async_engine.connect() as conn:
+                raw = (await conn.get_raw_connection()).driver_connection
+                await raw.add_listener(EVENTS_CHANNEL, on_notify)
+                print(f"📡 Relaying match events from {EVENTS_CHANNEL}")
+                try:
+                    while True:
+                        await asyncio.sleep(EVENTS_KEEPALIVE_SECONDS)
+                        await raw.execute("SELECT 1") # Notice a dead connection
+                finally:
+                    # Don't hand a listening connection back to the pool
+                    await conn.invalidate()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            broker.stats["relay_errors"] += 1
+            print(f"Match event relay lost: {e}")
+        await asyncio.sleep(EVENTS_RECONNECT_SECONDS)
+
+
+async def stream(tag: str):
+    """SSE body for one connection: `match` events (with the H2H delta), `resync`, keepalives."""
+    queue = broker.subscribe(tag)
+    try:
+        yield f"retry: {EVENTS_RECONNECT_SECONDS * 1000}\n\n"
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {item['type']}\ndata: {json.dumps(item)}\n\n"
+    finally:
+        broker.unsubscribe(tag, queue)
@@ -0,0 +1,45 @@
+"""
+Fast path for large list responses (match history, friend lists).
+
+The query selects exactly the response columns, so rows are zipped straight
+into dicts and encoded, skipping per-row Pydantic validation. Uses orjson
+when installed, the stdlib encoder otherwise. Output matches what FastAPI
+produces for the same response_model. `python bench_json.py` compares the two.
+"""
+import json
+from datetime import date, datetime
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODER = "orjson" if orjson else "json"
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    # Same separators/escaping as Starlette's JSONResponse
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def records(rows, fields: tuple) -> list:
+    """Rows whose leading columns are `fields`, as dicts (extra trailing columns are dropped)."""
+    return [dict(zip(fields, row)) for row in rows]
+
+
+class FastJSONResponse(Response):
+    """Return from a handler to bypass response_model validation; the shape must already be right."""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,80 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+# --- Configuration ---
+# bcrypt cost. Hashes with any other cost are re-hashed on the next successful login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# Threads dedicated to bcrypt (it releases the GIL), and how many hash/verify
+# calls may be running or waiting before new ones are rejected with 503.
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", 2))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", 32))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# Separate from the AnyIO threadpool so a login burst can't starve other sync routes
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_lock = threading.Lock()
+stats = {"pending": 0, "completed": 0, "rejected": 0, "rehashed": 0,
+         "total_seconds": 0.0, "max_seconds": 0.0}
+
+
+class HashQueueFull(Exception):
+    pass
+
+
+async def _submit(fn, *args):
+    with _lock:
+        if stats["pending"] >= HASH_QUEUE_SIZE:
+            stats["rejected"] += 1
+            raise HashQueueFull()
+        stats["pending"] += 1
+
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+    finally:
+        # Latency includes queue wait, which is what callers actually feel
+        elapsed = time.perf_counter() - started
+        with _lock:
+            stats["pending"] -= 1
+            stats["completed"] += 1
+            stats["total_seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+
+async def hash_password(password: str) -> str:
+    return await _submit(pwd_context.hash, password)
+
+
+async def verify_password(plain: str, hashed: str):
+    """
+    Returns (ok, new_hash). new_hash is set when the stored hash used
+    different bcrypt parameters and should be replaced.
+    """
+    ok, new_hash = await _submit(pwd_context.verify_and_update, plain, hashed)
+    if new_hash:
+        with _lock:
+            stats["rehashed"] += 1
+    return ok, new_hash
+
+
+def snapshot() -> dict:
+    with _lock:
+        done = stats["completed"]
+        return {
+            **stats,
+            "workers": HASH_WORKERS,
+            "queue_size": HASH_QUEUE_SIZE,
+            "avg_seconds": stats["total_seconds"] / done if done else 0.0,
+        }
@@ -0,0 +1,129 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, delete, case, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+import database
+import cr_api
+
+# --- Configuration ---
+# Running jobs older than this belong to a dead worker and are queued again
+JOB_TIMEOUT = int(os.getenv("SYNC_JOB_TIMEOUT_SECONDS", 300))
+# Finished jobs are kept this long for polling, then deleted
+JOB_RETENTION = int(os.getenv("SYNC_JOB_RETENTION_SECONDS", 86400))
+
+ACTIVE = ("queued", "running")
+
+
+def utcnow():
+    # DateTime columns are naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _insert(dialect: str):
+    # Both dialects take ON CONFLICT against the partial ux_sync_jobs_active index
+    return (pg_insert if dialect == "postgresql" else sqlite_insert)(models.SyncJob)
+
+
+async def enqueue(db: AsyncSession, user_id: int, priority: int = cr_api.INTERACTIVE) -> models.SyncJob:
+    """Queue a sync for `user_id`, or return the one already queued/running. Commits."""
+    J = models.SyncJob
+    stmt = _insert(db.bind.dialect.name).values(user_id=user_id, priority=priority, status="queued", created_at=utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[J.user_id], index_where=J.status.in_(ACTIVE),
+        # A manual sync overtakes a pending scheduled one; a running one is left alone
+        set_={"priority": case((stmt.excluded.priority < J.priority, stmt.excluded.priority), else_=J.priority)},
+        where=J.status == "queued",
+    )
+    await db.execute(stmt)
+    await db.commit()
+    # The active job, or the newest one if it finished in the meantime
+    return await db.scalar(
+        select(J).where(J.user_id == user_id).order_by(J.status.in_(ACTIVE).desc(), J.id.desc()).limit(1)
+    )
+
+
+def enqueue_many(db, user_ids: list, priority: int = cr_api.BACKGROUND) -> int:
+    """Queue syncs for every user in `user_ids` without an active job. Commits; returns how many."""
+    if not user_ids:
+        return 0
+    J = models.SyncJob
+    now = utcnow()
+    stmt = _insert(db.bind.dialect.name).values(
+        [{"user_id": uid, "priority": priority, "status": "queued", "created_at": now} for uid in user_ids]
+    ).on_conflict_do_nothing(index_elements=[J.user_id], index_where=J.status.in_(ACTIVE))
+    queued = db.execute(stmt).rowcount
+    db.commit()
+    return queued
+
+
+def retire_duplicates(conn) -> int:
+    """
+    Fail all but the newest active job per user, so ux_sync_jobs_active can
+    be built on a table filled before it existed. Run before creating indexes.
+    """
+    J = models.SyncJob
+    newest = select(func.max(J.id)).where(J.status.in_(ACTIVE)).group_by(J.user_id)
+    return conn.execute(
+        update(J).where(J.status.in_(ACTIVE), J.id.not_in(newest))
+        .values(status="failed", finished_at=utcnow(), error="duplicate job")
+    ).rowcount
+
+
+def claim(limit: int) -> list:
+    """
+    Take up to `limit` queued jobs, manual first. SKIP LOCKED lets several
+    workers claim concurrently without blocking on or double-taking rows.
+    Returns (job_id, user_id, priority) tuples.
+    """
+    J = models.SyncJob
+    db = database.SessionLocal()
+    try:
+        jobs = db.execute(
+            select(J).where(J.status == "queued").order_by(J.priority, J.id).limit(limit)
+            .with_for_update(skip_locked=True)
+        ).scalars().all()
+        now = utcnow()
+        for job in jobs:
+            job.status, job.started_at = "running", now
+        claimed = [(job.id, job.user_id, job.priority) for job in jobs]
+        db.commit()
+        return claimed
+    finally:
+        db.close()
+
+
+def finish(done: list, failed: list, error: str = None):
+    J = models.SyncJob
+    db = database.SessionLocal()
+    try:
+        now = utcnow()
+        if done:
+            db.execute(update(J).where(J.id.in_(done)).values(status="done", finished_at=now))
+        if failed:
+            db.execute(update(J).where(J.id.in_(failed)).values(status="failed", finished_at=now, error=error))
+        db.commit()
+    finally:
+        db.close()
+
+
+def housekeep():
+    """Requeue jobs orphaned by a crashed worker and drop old finished ones."""
+    J = models.SyncJob
+    db = database.SessionLocal()
+    try:
+        now = utcnow()
+        requeued = db.execute(
+            update(J).where(J.status == "running", J.started_at < now - timedelta(seconds=JOB_TIMEOUT))
+            .values(status="queued", started_at=None)
+        ).rowcount
+        db.execute(delete(J).where(J.status.in_(("done", "failed")), J.finished_at < now - timedelta(seconds=JOB_RETENTION)))
+        db.commit()
+        if requeued:
+            print(f"♻️ Requeued {requeued} stalled sync jobs")
+    finally:
+        db.close()
@@ -0,0 +1,94 @@
+import os
+import time
+import threading
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import models
+import database
+
+# --- Configuration ---
+# How often (seconds) a process checks whether another one changed the tag set
+KNOWN_TAGS_CHECK = float(os.getenv("KNOWN_TAGS_CHECK_SECONDS", 30))
+
+COUNTER = "known_tags"
+
+
+class KnownTags:
+    """
+    In-process set of every linked player tag, used by sync to decide which
+    battles are worth saving.
+
+    Loaded once with a tag-only query. Writers (signup, link-tag) bump the
+    `known_tags` counter in their transaction and patch the local set after
+    commit; other processes notice the new version on their next check and reload.
+    """
+    def __init__(self):
+        self.tags = frozenset()
+        self.version = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"reloads": 0, "checks": 0, "local_updates": 0}
+
+    def _read_version(self, db) -> int:
+        return db.execute(select(models.Counter.value).where(models.Counter.name == COUNTER)).scalar() or 0
+
+    def reload(self):
+        db = database.SessionLocal()
+        try:
+            # Version first: a bump landing between the two reads just causes one extra reload
+            version = self._read_version(db)
+            tags = frozenset(db.execute(select(models.User.player_tag).where(models.User.player_tag != None)).scalars())
+        finally:
+            db.close()
+        with self.lock:
+            self.tags, self.version = tags, version
+            self.checked_at = time.monotonic()
+            self.stats["reloads"] += 1
+
+    def current(self) -> frozenset:
+        """The tag set, reloaded first if another process has changed it."""
+        if self.version is None:
+            self.reload()
+        elif time.monotonic() - self.checked_at >= KNOWN_TAGS_CHECK:
+            db = database.SessionLocal()
+            try:
+                version = self._read_version(db)
+            finally:
+                db.close()
+            self.stats["checks"] += 1
+            self.checked_at = time.monotonic()
+            if version != self.version:
+                self.reload()
+        return self.tags
+
+    def bump(self, db) -> int:
+        """Increment the shared version inside the caller's transaction; returns the new value."""
+        insert = pg_insert if database.engine.dialect.name == "postgresql" else sqlite_insert
+        C = models.Counter
+        stmt = insert(C).values(name=COUNTER, value=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["name"],
+            set_={"value": C.value + 1},
+        ).returning(C.value)
+        return db.execute(stmt).scalar()
+
+    def apply(self, version: int, add: str = None, remove: str = None):
+        """Patch the local set after the bumping transaction committed."""
+        with self.lock:
+            tags = set(self.tags)
+            if remove: tags.discard(remove)
+            if add: tags.add(add)
+            self.tags = frozenset(tags)
+            # Only skip the reload if nobody else bumped in between
+            if self.version is not None and version == self.version + 1:
+                self.version = version
+            self.stats["local_updates"] += 1
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "size": len(self.tags), "version": self.version}
+
+
+known_tags = KnownTags()
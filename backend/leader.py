@@ -0,0 +1,93 @@
+import os
+import asyncio
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+
+import database
+
+# --- Configuration ---
+# App-wide Postgres advisory lock id; only the holder runs background sync
+SYNC_LOCK_KEY = int(os.getenv("SYNC_LOCK_KEY", 7342017))
+LEADER_CHECK = int(os.getenv("LEADER_CHECK_SECONDS", 15))
+
+# Unpooled, so closing a lock connection really ends the session (and the
+# session-level lock with it) instead of parking it, lock held, in the pool
+_lock_engine = None
+
+
+def _engine():
+    global _lock_engine
+    if _lock_engine is None:
+        _lock_engine = create_engine(database.DATABASE_URL, poolclass=NullPool, isolation_level="AUTOCOMMIT")
+    return _lock_engine
+
+
+def _try_lock():
+    """Open a dedicated connection and try to take the lock on it. Returns the connection or None."""
+    conn = None
+    try:
+        conn = _engine().connect()
+        if conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": SYNC_LOCK_KEY}).scalar():
+            return conn
+    except Exception as e:
+        # DB unreachable counts as "not leader"; the caller retries after LEADER_CHECK
+        print(f"Leader election error: {e}")
+    if conn is not None:
+        _release(conn)
+    return None
+
+
+def _alive(conn) -> bool:
+    try:
+        conn.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
+
+
+def _release(conn):
+    try:
+        conn.execute(text("SELECT pg_advisory_unlock_all()"))
+    except Exception:
+        pass # Connection already gone: Postgres dropped the lock with it
+    try:
+        conn.close() # Unpooled: this ends the session
+    except Exception:
+        pass
+
+
+async def run_as_leader(job):
+    """
+    Run `job()` only while this process holds the sync advisory lock.
+
+    The lock is session-level on a dedicated connection, so if the leader
+    dies Postgres drops the connection and the lock with it; the other
+    processes keep retrying every LEADER_CHECK seconds and one takes over.
+    Non-Postgres databases (SQLite in dev) are single-process: always lead.
+    """
+    if database.engine.dialect.name != "postgresql":
+        await job()
+        return
+
+    while True:
+        conn = await asyncio.to_thread(_try_lock)
+        if conn is None:
+            await asyncio.sleep(LEADER_CHECK)
+            continue
+
+        print(f"👑 Acquired sync leadership (pid {os.getpid()})")
+        task = asyncio.create_task(job())
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=LEADER_CHECK)
+                if not task.done() and not await asyncio.to_thread(_alive, conn):
+                    print("⚠️ Lost leader connection, stepping down")
+                    break
+        finally:
+            task.cancel()
+            await asyncio.to_thread(_release, conn)
+
+        if task.done() and not task.cancelled() and task.exception():
+            print(f"Leader job crashed: {task.exception()}")
+        await asyncio.sleep(LEADER_CHECK)
@@ -1,17 +1,22 @@
+import io
 import os
-import hashlib
-import requests
+import csv
+import time
+import zlib
+import anyio
 import asyncio
 import secrets
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException, status, Body, BackgroundTasks
+from fastapi import FastAPI, Depends, HTTPException, Body, BackgroundTasks, Query, Request, Response, Header
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from passlib.context import CryptContext
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 from jose import JWTError, jwt
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 
@@ -19,6 +24,21 @@ from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
 import models
 import schemas
 import database
+import events
+import fastjson
+from cache import ExpiringDict
+import crud
+import cr_api
+import hashing
+import metrics
+import migrate
+import profiler
+import sync
+from cooldowns import cooldowns
+from known_tags import known_tags
+import jobs
+import worker
+from profiles import refresher
 
 # --- Configuration ---
 def get_env(key, default=None):
@@ -34,9 +54,25 @@ def get_env(key, default=None):
 SECRET_KEY = get_env("SECRET_KEY", "dev_unsafe_secret")
 CR_API_KEY = get_env("CR_API_KEY") 
 FRONTEND_URL = get_env("FRONTEND_URL", "http://localhost:3000")
-API_BASE = "https://proxy.royaleapi.dev/v1"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+# Authenticated-user cache (seconds / entries). AUTH_TOKEN_CLAIMS=1 also puts the
+# user id + tag in new tokens so read-only endpoints can skip the users table.
+AUTH_CACHE_TTL = int(get_env("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_SIZE = int(get_env("AUTH_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CLAIMS = get_env("AUTH_TOKEN_CLAIMS", "0") == "1"
+# After a user's own write, their reads skip replicas for this long (read-your-writes)
+STICKY_PRIMARY_SECONDS = int(get_env("STICKY_PRIMARY_SECONDS", "10"))
+# Per-user /dashboard cache (seconds); only served while the user's ETag still matches
+DASHBOARD_CACHE_TTL = int(get_env("DASHBOARD_CACHE_TTL", "10"))
+# Rows fetched per round trip by /matches/export (its memory use is bounded by this)
+EXPORT_BATCH_ROWS = int(get_env("EXPORT_BATCH_ROWS", "1000"))
+# Bearer token for /metrics and /internal/stats; unset = both return 404
+INTERNAL_TOKEN = get_env("INTERNAL_TOKEN", "")
+# Lifetime of the /events tickets (seconds); only needs to cover opening the stream
+EVENTS_TICKET_SECONDS = int(get_env("EVENTS_TICKET_SECONDS", "60"))
+# Run the sync worker (job consumer, and scheduler when leader) inside the API process
+SYNC_IN_API = get_env("SYNC_IN_API", "1") == "1"
 
 # Mail Config
 mail_conf = ConnectionConfig(
@@ -52,7 +88,10 @@ mail_conf = ConnectionConfig(
 )
 
 # Database & App Init
-models.Base.metadata.create_all(bind=database.engine)
+# Postgres deploys run `python migrate.py` before starting processes (the
+# Docker image's entrypoint does); single-process SQLite dev migrates on start
+if database.engine.dialect.name == "sqlite":
+    migrate.run()
 app = FastAPI(title="ClashFriends API")
 
 # CORS Security
@@ -69,24 +108,73 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+@app.middleware("http")
+async def record_metrics(request, call_next):
+    db_usage = [0, 0.0]
+    metrics.request_db.set(db_usage)
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Label by route template (/users/{uid}/friends), not the raw path
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.http_requests.inc(request.method, route, status_code)
+        metrics.http_latency.observe(request.method, route, value=time.perf_counter() - started)
+        metrics.http_db_queries.observe(route, value=db_usage[0])
+        metrics.http_db_time.observe(route, value=db_usage[1])
+
+if profiler.SQL_PROFILE:
+    @app.middleware("http")
+    async def profile_sql(request, call_next):
+        profile = profiler.start(f"{request.method} {request.url.path}")
+        response = await call_next(request)
+        route = getattr(request.scope.get("route"), "path", request.url.path)
+        profiler.finish(profile, f"{request.method} {route}")
+        if profiler.SQL_PROFILE_HEADER:
+            response.headers["X-SQL-Profile"] = profile.header()
+        return response
+
+def threadpool_usage():
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    stats = limiter.statistics()
+    return {("in_use",): stats.borrowed_tokens, ("size",): limiter.total_tokens, ("waiting",): stats.tasks_waiting}
+
+metrics.Gauge("threadpool_threads", "AnyIO threadpool running sync routes (in_use/size/waiting)", ("state",), threadpool_usage)
+metrics.Gauge("hash_pool_pending", "bcrypt calls running or queued", fn=lambda: {(): hashing.stats["pending"]})
+metrics.Gauge("db_replica_lag_seconds", "Replication lag per replica (-1 = unreachable)", ("replica",),
+              lambda: {(r.engine.url.host or str(i),): -1 if r.lag is None else r.lag for i, r in enumerate(database.replicas)})
+metrics.Gauge("events_subscribers", "Open /events streams in this process", fn=lambda: {(): events.broker.snapshot()["subscribers"]})
+metrics.Gauge("cr_api_budget_tokens", "Tokens left in the CR API budget", fn=lambda: {(): cr_api.budget.snapshot()["tokens"]})
+
 # Auth Helpers
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def verify_password(plain, hashed):
-    return pwd_context.verify(plain, hashed)
-
-def get_hash(password):
-    return pwd_context.hash(password)
-
 def create_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=15))
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def token_claims(user) -> dict:
+    claims = {"sub": user.email}
+    if AUTH_TOKEN_CLAIMS:
+        claims.update({"uid": user.id, "tag": user.player_tag})
+    return claims
+
+# Principal cache: token subject (email) -> schemas.CurrentUser
+principals = ExpiringDict(ttl=AUTH_CACHE_TTL, max_size=AUTH_CACHE_SIZE)
+claims_stats = {"hits": 0}
+# Token subjects that wrote recently and must read from the primary (per process)
+recent_writers = ExpiringDict(ttl=STICKY_PRIMARY_SECONDS, max_size=AUTH_CACHE_SIZE)
+# Token subject (email) -> (ETag, dashboard payload)
+dashboards = ExpiringDict(ttl=DASHBOARD_CACHE_TTL, max_size=AUTH_CACHE_SIZE)
+
 def get_db():
     db = database.SessionLocal()
     try:
@@ -94,125 +182,147 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    # For async handlers: queries are awaited on the loop, no threadpool hop
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+async def get_read_db(token: str = Depends(oauth2_scheme)):
+    """Read-only session: a healthy replica unless this user wrote in the last few seconds."""
+    sticky = recent_writers.get(decode_token(token)["sub"]) is not None
+    async with database.AsyncSessionLocal(bind=database.read_engine(primary=sticky)) as db:
+        yield db
+
+def mark_write(email: str):
+    recent_writers.set(email, True)
+    dashboards.pop(email)
+
+def require_internal(authorization: Optional[str] = Header(None)):
+    """Ops endpoints: hidden unless INTERNAL_TOKEN is set, then `Authorization: Bearer <INTERNAL_TOKEN>`."""
+    if not INTERNAL_TOKEN:
+        raise HTTPException(404, "Not Found")
+    if not authorization or not secrets.compare_digest(authorization, f"Bearer {INTERNAL_TOKEN}"):
+        raise HTTPException(401, "Invalid internal token")
+
+# --- Conditional GET ---
+async def check_etag(request: Request, response: Response, db: AsyncSession, user_id: int,
+                     matches: bool = False, friends: bool = False):
+    """
+    ETag from the user's version counters (plus the query string, since it
+    changes the listing). Returns a bare 304 for the handler to return as-is
+    when If-None-Match already has it; otherwise sets the ETag on `response`.
+    """
+    versions = await crud.fetch_versions(db, user_id)
+    if versions is None:
+        return None
+    parts = []
+    if matches: parts.append(versions.matches_version)
+    if friends: parts.append(versions.friends_version)
+    return etag_response(request, response, make_etag(request, user_id, *parts))
+
+def make_etag(request: Request, user_id: int, *versions) -> str:
+    return 'W/"' + "-".join(map(str, [user_id, *versions, f"{zlib.crc32(request.url.query.encode()):x}"])) + '"'
+
+def etag_response(request: Request, response: Response, etag: str):
+    """A bare 304 if If-None-Match already has `etag`, else None with the ETag set on `response`."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    sent = request.headers.get("if-none-match", "")
+    if sent.strip() == "*" or etag in (t.strip() for t in sent.split(",")):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 # --- External API Helpers ---
-def fetch_cr_player(tag: str):
+async def get_cr_player(tag: str):
+    """Profile for `tag` or None if it doesn't exist; 503 when the CR API can't answer."""
     if not CR_API_KEY:
         return None
-    clean_tag = tag.replace("#", "%23")
     try:
-        resp = requests.get(f"{API_BASE}/players/{clean_tag}", headers={"Authorization": f"Bearer {CR_API_KEY}"}, timeout=5)
-        if resp.status_code == 200:
-            return resp.json()
-    except Exception as e:
+        return await cr_api.player_profiles.get(tag)
+    except cr_api.RateLimited as e:
+        raise HTTPException(503, "Clash Royale API is busy, try again shortly", headers={"Retry-After": str(int(e.retry_after))})
+    except cr_api.CRApiError as e:
         print(f"CR API Fail: {e}")
-    return None
+        raise HTTPException(503, "Clash Royale API unavailable")
 
-def generate_battle_id(battle_time, p1, p2):
-    # Unique ID based on time and sorted player tags
-    t1, t2 = sorted([p1.replace("#",""), p2.replace("#","")])
-    raw = f"{battle_time}-{t1}-{t2}"
-    return hashlib.md5(raw.encode()).hexdigest()
+async def lookup_cr_player(tag: str):
+    """
+    Like get_cr_player, but while the CR API is failing serve whatever copy
+    the profile cache still holds, however old. Returns (data, degraded).
+    """
+    try:
+        return await get_cr_player(tag), False
+    except HTTPException:
+        cached = cr_api.player_profiles.peek(tag)
+        if cached is None:
+            raise
+        return cached, True
+
+def fetch_cr_player(tag: str):
+    # Sync routes run in AnyIO worker threads; hop onto the loop that owns the cache/client
+    return anyio.from_thread.run(get_cr_player, tag)
 
 # --- Dependencies ---
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def decode_token(token: str) -> dict:
     auth_exception = HTTPException(status_code=401, detail="Invalid credentials", headers={"WWW-Authenticate": "Bearer"})
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None: raise auth_exception
     except JWTError:
         raise auth_exception
-    
-    user = db.query(models.User).filter(models.User.email == email).first()
-    if user is None: raise auth_exception
+    if payload.get("sub") is None: raise auth_exception
+    # Scoped tokens (password reset, /events tickets) are not access tokens
+    if "type" in payload: raise auth_exception
+    return payload
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)) -> schemas.CurrentUser:
+    email = decode_token(token)["sub"]
+
+    user = principals.get(email)
+    if user is None:
+        row = await crud.fetch_user_by_email(db, email)
+        if row is None and database.replicas:
+            # Maybe just created and not replicated yet; the primary decides
+            async with database.AsyncSessionLocal() as primary:
+                row = await crud.fetch_user_by_email(primary, email)
+        if row is None:
+            raise HTTPException(status_code=401, detail="Invalid credentials", headers={"WWW-Authenticate": "Bearer"})
+        user = schemas.CurrentUser.model_validate(row)
+        principals.set(email, user)
     return user
 
-# --- Background Sync Logic ---
-async def sync_user_matches(db: Session, user: models.User, known_tags: set):
-    if not user.player_tag or not CR_API_KEY: return
-    
-    clean_tag = user.player_tag.replace("#", "%23")
-    url = f"{API_BASE}/players/{clean_tag}/battlelog"
-    headers = {"Authorization": f"Bearer {CR_API_KEY}"}
-    
-    try:
-        # Run synchronous request in thread to avoid blocking loop
-        resp = await asyncio.to_thread(requests.get, url, headers=headers, timeout=10)
-        
-        if resp.status_code == 429:
-            print(f"⚠️ Rate Limit. Skipping {user.username}")
-            return
-        if resp.status_code != 200:
-            return
-
-        battles = resp.json()
-        for b in battles:
-            try:
-                # Basic parsing
-                p1_tag = b["team"][0]["tag"]
-                p2_tag = b["opponent"][0]["tag"]
-                
-                # Only save if we know one of the players (optimization)
-                if p1_tag not in known_tags and p2_tag not in known_tags:
-                    continue
-
-                b_time_str = b["battleTime"]
-                bid = generate_battle_id(b_time_str, p1_tag, p2_tag)
-                
-                if db.query(models.Match).filter_by(battle_id=bid).first():
-                    continue
-                
-                # Determine winner
-                c1 = b["team"][0]["crowns"]
-                c2 = b["opponent"][0]["crowns"]
-                winner = p1_tag if c1 > c2 else (p2_tag if c2 > c1 else None)
-                
-                match_obj = models.Match(
-                    battle_id=bid,
-                    player_1_tag=p1_tag,
-                    player_2_tag=p2_tag,
-                    winner_tag=winner,
-                    battle_time=datetime.strptime(b_time_str, "%Y%m%dT%H%M%S.%fZ").replace(tzinfo=timezone.utc),
-                    game_mode=b.get("type", "Ladder"),
-                    crowns_1=c1,
-                    crowns_2=c2
-                )
-                db.add(match_obj)
-            except Exception:
-                continue # Skip bad records
-        db.commit()
-    except Exception as e:
-        print(f"Sync error for {user.username}: {e}")
-        db.rollback()
-
-async def background_sync_task():
-    await asyncio.sleep(5) # Startup buffer
-    while True:
-        print("🔄 Running Background Sync...")
-        db = database.SessionLocal()
-        try:
-            users = db.query(models.User).filter(models.User.player_tag != None).all()
-            known_tags = {u.player_tag for u in users}
-            
-            for user in users:
-                await sync_user_matches(db, user, known_tags)
-                await asyncio.sleep(0.5) # Throttle requests
-                
-        except Exception as e:
-            print(f"Fatal Sync Error: {e}")
-        finally:
-            db.close()
-        
-        print("✅ Sync finished. Sleeping 30m.")
-        await asyncio.sleep(1800)
+async def get_token_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_read_db)):
+    """
+    For read-only endpoints that only need id/tag. With AUTH_TOKEN_CLAIMS the
+    token already carries both, so no cache or DB lookup happens at all.
+    """
+    if AUTH_TOKEN_CLAIMS:
+        payload = decode_token(token)
+        if "uid" in payload:
+            claims_stats["hits"] += 1
+            return schemas.TokenPrincipal(id=payload["uid"], email=payload["sub"], player_tag=payload.get("tag"))
+    return await get_current_user(token, db)
 
 @app.on_event("startup")
 async def startup_event():
-    asyncio.create_task(background_sync_task())
+    # Single-process setups run the sync worker in here; otherwise start `python -m worker`
+    if SYNC_IN_API:
+        asyncio.create_task(worker.run())
+    if database.replicas:
+        asyncio.create_task(database.monitor_replicas())
+    if events.USE_NOTIFY:
+        asyncio.create_task(events.listen())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await cr_api.close_client()
+    await database.async_engine.dispose()
+
+@app.exception_handler(hashing.HashQueueFull)
+async def hash_queue_full_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Too many login attempts, try again"}, headers={"Retry-After": "1"})
 
 # --- Routes: Auth ---
-@app.post("/auth/signup", response_model=schemas.UserResponse)
-def signup(user_data: schemas.UserSignup, db: Session = Depends(get_db)):
+def check_signup(user_data: schemas.UserSignup, db: Session):
     # Invite Check
     if not user_data.invite_token:
         raise HTTPException(400, "Invite token required")
@@ -234,35 +344,66 @@ def signup(user_data: schemas.UserSignup, db: Session = Depends(get_db)):
         if db.query(models.User).filter_by(player_tag=clean_tag).first():
             raise HTTPException(400, "Tag already registered")
             
-        info = fetch_cr_player(clean_tag)
+        # The CR name is cosmetic; don't block signup on an upstream outage
+        try:
+            info = fetch_cr_player(clean_tag)
+        except HTTPException:
+            info = None
         if info: cr_name = info.get("name", cr_name)
 
+    return invite, cr_name, clean_tag
+
+def create_account(user_data: schemas.UserSignup, hashed_password: str, invite: models.Invite,
+                   cr_name: str, clean_tag: Optional[str], db: Session):
     new_user = models.User(
         email=user_data.email,
         username=cr_name,
         player_tag=clean_tag,
-        hashed_password=get_hash(user_data.password)
+        hashed_password=hashed_password
     )
     db.add(new_user)
+    version = known_tags.bump(db) if clean_tag else None
     db.commit()
     db.refresh(new_user)
+    if version: known_tags.apply(version, add=clean_tag)
     
     # Auto-friend inviter
     u1, u2 = sorted([new_user.id, invite.creator_id])
     if u1 != u2:
         db.add(models.Friendship(user_id_1=u1, user_id_2=u2))
         invite.used_count += 1
+        crud.bump_friends_version(db, [u1, u2])
         db.commit()
         
-    return new_user
+    return schemas.UserResponse.model_validate(new_user)
+
+@app.post("/auth/signup", response_model=schemas.UserResponse)
+async def signup(user_data: schemas.UserSignup, db: Session = Depends(get_db)):
+    # Validate before spending any bcrypt time; DB work stays in the threadpool,
+    # hashing goes to its own pool.
+    invite, cr_name, clean_tag = await run_in_threadpool(check_signup, user_data, db)
+    hashed = await hashing.hash_password(user_data.password)
+    user = await run_in_threadpool(create_account, user_data, hashed, invite, cr_name, clean_tag, db)
+    # The account only exists on the primary until replicas catch up
+    mark_write(user.email)
+    return user
 
 @app.post("/auth/login")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter_by(email=form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = await run_in_threadpool(crud.get_user_by_email, db, form_data.username)
+    if not user:
+        raise HTTPException(401, "Bad credentials")
+    ok, new_hash = await hashing.verify_password(form_data.password, user.hashed_password)
+    if not ok:
         raise HTTPException(401, "Bad credentials")
     
-    token = create_token({"sub": user.email}, timedelta(days=7))
+    token = create_token(token_claims(user), timedelta(days=7))
+    if new_hash:
+        # bcrypt cost changed since this hash was made; upgrade it transparently
+        user.hashed_password = new_hash
+        await run_in_threadpool(db.commit)
+    # The first reads after login shouldn't 401 on a replica that hasn't seen a fresh signup
+    mark_write(user.email)
     return {"access_token": token, "token_type": "bearer"}
 
 @app.post("/auth/forgot-password")
@@ -287,7 +428,7 @@ async def forgot_password(req: schemas.PasswordResetRequest, tasks: BackgroundTa
     return {"message": "If account exists, email sent"}
 
 @app.post("/auth/reset-password")
-def reset_password(req: schemas.PasswordResetConfirm, db: Session = Depends(get_db)):
+async def reset_password(req: schemas.PasswordResetConfirm, db: Session = Depends(get_db)):
     try:
         payload = jwt.decode(req.token, SECRET_KEY, algorithms=[ALGORITHM])
         if payload.get("type") != "reset": raise Exception()
@@ -295,58 +436,200 @@ def reset_password(req: schemas.PasswordResetConfirm, db: Session = Depends(get_
     except:
         raise HTTPException(400, "Invalid token")
         
-    user = db.query(models.User).filter_by(email=email).first()
+    user = await run_in_threadpool(crud.get_user_by_email, db, email)
     if not user: raise HTTPException(404, "User not found")
     
-    user.hashed_password = get_hash(req.new_password)
-    db.commit()
+    user.hashed_password = await hashing.hash_password(req.new_password)
+    await run_in_threadpool(db.commit)
+    principals.pop(email)
+    mark_write(email)
     return {"message": "Password updated"}
 
 # --- Routes: Core ---
 @app.get("/users/me", response_model=schemas.UserResponse)
-def get_me(current: models.User = Depends(get_current_user)):
+def get_me(current: schemas.CurrentUser = Depends(get_current_user)):
     return current
 
 @app.get("/matches", response_model=List[schemas.MatchResponse])
-def get_matches(current: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_matches(
+    request: Request,
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    opponent: Optional[str] = None,
+    game_mode: Optional[str] = None,
+    current: schemas.TokenPrincipal = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_read_db)
+):
     if not current.player_tag: return []
-    return db.query(models.Match).filter(
-        or_(models.Match.player_1_tag == current.player_tag, 
-            models.Match.player_2_tag == current.player_tag)
-    ).order_by(models.Match.battle_time.desc()).limit(50).all()
+    not_modified = await check_etag(request, response, db, current.id, matches=True)
+    if not_modified: return not_modified
+    if opponent:
+        opponent = opponent.upper()
+        if not opponent.startswith("#"): opponent = f"#{opponent}"
+
+    try:
+        rows, next_cursor = await crud.get_matches_for_player(db, current.player_tag, limit, cursor, opponent, game_mode)
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+    # Body stays a plain list; pass next_cursor back as ?cursor= for the next page
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    # Rows are already MatchResponse-shaped: skip per-row validation
+    return fastjson.FastJSONResponse(fastjson.records(rows, crud.MATCH_FIELDS), headers=response.headers)
+
+async def export_chunks(stmt, fmt: str):
+    """Encoded export chunks, one per `yield_per` partition of a server-side cursor."""
+    fields = crud.MATCH_FIELDS
+    # Own session: the stream outlives the handler, and a replica is fine for history
+    async with database.AsyncSessionLocal(bind=database.read_engine()) as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow(fields)
+        async for rows in result.partitions():
+            if fmt == "ndjson":
+                yield b"".join(fastjson.dumps(r) + b"\n" for r in fastjson.records(rows, fields))
+                continue
+            for row in rows:
+                writer.writerow(v.isoformat() if isinstance(v, datetime) else v for v in row[:len(fields)])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+        if fmt == "csv" and buf.tell():
+            yield buf.getvalue() # Header only: no matches
+
+@app.get("/matches/export")
+async def export_matches(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    opponent: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    token: str = Depends(oauth2_scheme),
+):
+    """
+    The user's complete match history, oldest first, streamed as NDJSON or CSV.
+    Memory stays flat however long the history is. `since`/`until` bound battle_time.
+    """
+    async with database.AsyncSessionLocal() as db:
+        current = await get_token_principal(token, db)
+    if not current.player_tag: raise HTTPException(400, "No player tag linked")
+    if opponent:
+        opponent = opponent.upper()
+        if not opponent.startswith("#"): opponent = f"#{opponent}"
+    # battle_time is stored as naive UTC
+    since, until = (sync.as_utc(t).astimezone(timezone.utc).replace(tzinfo=None) if t else None for t in (since, until))
+
+    stmt = crud.matches_export_stmt(current.player_tag, opponent, since, until)
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"matches-{current.player_tag.lstrip('#')}.{format}"
+    return StreamingResponse(export_chunks(stmt, format), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/dashboard", response_model=schemas.DashboardResponse)
+async def get_dashboard(
+    request: Request,
+    response: Response,
+    match_limit: int = Query(20, ge=0, le=100),
+    current: schemas.TokenPrincipal = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Everything the dashboard shows (profile, H2H standings, recent matches)
+    in one request and one query, which also reads the ETag's version
+    counters. Only a recently cached dashboard is revalidated with the
+    cheap version lookup first, to skip the big query if nothing changed.
+    """
+    cached = dashboards.get(current.email)
+    if cached:
+        not_modified = await check_etag(request, response, db, current.id, matches=True, friends=True)
+        if not_modified: return not_modified
+        if cached[0] == response.headers.get("etag"):
+            return cached[1]
+
+    data = await crud.get_dashboard(db, current.id, current.player_tag, match_limit)
+    if data["profile"] is None:
+        raise HTTPException(status_code=401, detail="Invalid credentials", headers={"WWW-Authenticate": "Bearer"})
+    etag = make_etag(request, current.id, *data.pop("versions"))
+    dashboards.set(current.email, (etag, data))
+    return etag_response(request, response, etag) or data
+
+@app.get("/h2h", response_model=List[schemas.H2HStanding])
+async def get_h2h(request: Request, response: Response,
+                  current: schemas.TokenPrincipal = Depends(get_token_principal), db: AsyncSession = Depends(get_read_db)):
+    not_modified = await check_etag(request, response, db, current.id, matches=True, friends=True)
+    if not_modified: return not_modified
+    return await crud.get_h2h_standings(db, current)
 
 # Manual Sync Rate Limit
-sync_cooldowns = {}
+SYNC_COOLDOWN_SECONDS = 120
 
-@app.post("/sync/{player_tag}")
-async def force_sync(player_tag: str, db: Session = Depends(get_db)):
+@app.post("/sync/{player_tag}", status_code=202, response_model=schemas.SyncJobResponse)
+async def force_sync(player_tag: str, current: schemas.CurrentUser = Depends(get_current_user),
+                     db: AsyncSession = Depends(get_async_db)):
     tag = player_tag.upper()
     if not tag.startswith("#"): tag = f"#{tag}"
     
-    last = sync_cooldowns.get(tag)
-    if last and (datetime.now() - last).seconds < 120:
-        raise HTTPException(429, "Wait 2 mins")
-    
-    user = db.query(models.User).filter_by(player_tag=tag).first()
-    if not user: raise HTTPException(404, "User not found")
-    
-    sync_cooldowns[tag] = datetime.now()
-    
-    # Refresh Profile
-    data = fetch_cr_player(tag)
-    if data:
-        user.username = data.get("name", user.username)
-        user.trophies = data.get("trophies", user.trophies)
-        db.commit()
+    user = await crud.fetch_user_by_tag(db, tag)
+    # Your own tag or a friend's; anyone else's looks like an unknown tag
+    if not user or (user.id != current.id and not await crud.are_friends(db, current.id, user.id)):
+        raise HTTPException(404, "User not found")
     
-    # Run Sync
-    all_tags = {u.player_tag for u in db.query(models.User).filter(models.User.player_tag != None).all()}
-    await sync_user_matches(db, user, all_tags)
+    if not await run_in_threadpool(cooldowns.claim, tag, SYNC_COOLDOWN_SECONDS):
+        raise HTTPException(429, "Wait 2 mins")
     
-    return {"status": "synced"}
-
-@app.put("/users/link-tag")
-def link_tag(req: schemas.LinkTagRequest, current: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+    # A worker syncs the battlelog and refreshes the profile; poll /sync/jobs/{id}
+    job = await jobs.enqueue(db, user.id, cr_api.INTERACTIVE)
+    mark_write(current.email)
+    worker.wakeup.set()
+    return job
+
+@app.get("/sync/jobs/{job_id}", response_model=schemas.SyncJobResponse)
+async def get_sync_job(job_id: int, current: schemas.TokenPrincipal = Depends(get_token_principal),
+                       db: AsyncSession = Depends(get_async_db)):
+    job = await db.get(models.SyncJob, job_id)
+    # Jobs are visible to whoever may start them (the user and their friends); others get a 404
+    if not job or (job.user_id != current.id and not await crud.are_friends(db, current.id, job.user_id)):
+        raise HTTPException(404, "Job not found")
+    if job.status == "done":
+        # The worker changed trophies/name behind the principal cache's back
+        principals.pop(current.email)
+        # Fresh battles are on the primary; replicas may not have them yet
+        mark_write(current.email)
+    return job
+
+@app.post("/events/ticket")
+async def create_events_ticket(current: schemas.TokenPrincipal = Depends(get_token_principal)):
+    """
+    Short-lived token for opening GET /events. EventSource can't set headers,
+    so it goes in the URL, where access logs and history keep it: it must not
+    be the 7-day access token.
+    """
+    if not current.player_tag: raise HTTPException(400, "No player tag linked")
+    ticket = create_token({"sub": current.email, "type": "events", "tag": current.player_tag},
+                          timedelta(seconds=EVENTS_TICKET_SECONDS))
+    return {"ticket": ticket, "expires_in": EVENTS_TICKET_SECONDS}
+
+@app.get("/events")
+async def get_events(ticket: str = Query(...)):
+    """
+    Server-sent events: each battle ingested for the user, with its H2H delta,
+    as soon as the sync writer commits it. Opened with a ticket from
+    POST /events/ticket; the stream outlives the ticket, reconnects need a new one.
+    """
+    try:
+        claims = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(401, "Invalid or expired ticket")
+    if claims.get("type") != "events" or not claims.get("tag"):
+        raise HTTPException(401, "Invalid or expired ticket")
+    return StreamingResponse(events.stream(claims["tag"]), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.put("/users/link-tag", response_model=schemas.LinkTagResponse)
+def link_tag(req: schemas.LinkTagRequest, current: schemas.CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     tag = req.player_tag.upper()
     if not tag.startswith("#"): tag = f"#{tag}"
     
@@ -358,22 +641,43 @@ def link_tag(req: schemas.LinkTagRequest, current: models.User = Depends(get_cur
     data = fetch_cr_player(tag)
     if not data: raise HTTPException(404, "Invalid CR Tag")
     
-    current.player_tag = tag
-    current.username = data.get("name", current.username)
-    current.trophies = data.get("trophies", 0)
-    current.clan_name = data.get("clan", {}).get("name")
+    # `current` is a cached snapshot; write through the real row
+    user = db.get(models.User, current.id)
+    old_tag = user.player_tag
+    user.player_tag = tag
+    user.username = data.get("name", user.username)
+    user.trophies = data.get("trophies", 0)
+    user.clan_name = data.get("clan", {}).get("name")
+    user.clan_tag = data.get("clan", {}).get("tag")
+    version = known_tags.bump(db) if tag != old_tag else None
+    if tag != old_tag:
+        # Sync state belonged to the old tag: start over, due now (also unparks a tag not found)
+        user.last_battle_time, user.idle_syncs, user.next_sync_at = None, 0, None
+        user.sync_failures, user.sync_parked_at = 0, None
+        db.flush() # The bump matches rows by player_tag, so the new tag must be written first
+        crud.bump_matches_version(db, [tag])
+    crud.bump_friends_version(db, friends_of=[user.id])
     db.commit()
-    return current
+    if version: known_tags.apply(version, add=tag, remove=old_tag)
+    db.refresh(user)
+    principals.pop(user.email)
+    mark_write(user.email)
+
+    resp = schemas.LinkTagResponse.model_validate(user)
+    if AUTH_TOKEN_CLAIMS:
+        resp.access_token = create_token(token_claims(user), timedelta(days=7))
+    return resp
 
 # --- Routes: Social ---
 @app.get("/invites/{token}", response_model=schemas.InviteResponse)
 def get_invite(token: str, db: Session = Depends(get_db)):
-    inv = db.query(models.Invite).filter_by(token=token).first()
+    # Creator comes in the same query rather than a lazy load on access
+    inv = db.query(models.Invite).options(joinedload(models.Invite.creator)).filter_by(token=token).first()
     if not inv: raise HTTPException(404, "Not found")
     return {"token": inv.token, "target_tag": inv.target_tag, "creator_username": inv.creator.username}
 
 @app.post("/invites/", response_model=schemas.InviteResponse)
-def create_invite(req: schemas.InviteCreate, current: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+def create_invite(req: schemas.InviteCreate, current: schemas.CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     token = secrets.token_urlsafe(8)
     inv = models.Invite(token=token, creator_id=current.id, target_tag=req.target_tag)
     db.add(inv)
@@ -381,26 +685,30 @@ def create_invite(req: schemas.InviteCreate, current: models.User = Depends(get_
     return {"token": token, "target_tag": inv.target_tag, "creator_username": current.username}
 
 @app.get("/search/player")
-def search(query: str, current: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def search(query: str, current: schemas.CurrentUser = Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
     q = query.strip().upper()
     if not q.startswith("#"): q = f"#{q}"
     
     # Check DB first
-    user = db.query(models.User).filter_by(player_tag=q).first()
+    user = await crud.fetch_user_by_tag(db, q)
     if user:
         u1, u2 = sorted([current.id, user.id])
-        is_friend = db.query(models.Friendship).filter_by(user_id_1=u1, user_id_2=u2).first() is not None
-        return {"status": "friend" if is_friend else "user_found", "user": user, "can_invite": False}
+        is_friend = await db.scalar(select(models.Friendship.id).where(
+            models.Friendship.user_id_1 == u1, models.Friendship.user_id_2 == u2)) is not None
+        # Public fields only (the ORM row carries the password hash)
+        return {"status": "friend" if is_friend else "user_found", "user": schemas.UserResponse.model_validate(user), "can_invite": False}
     
     # Check CR API
-    data = fetch_cr_player(q)
+    data, degraded = await lookup_cr_player(q)
     if data:
-        return {"status": "api_found", "tag": q, "name": data.get("name"), "can_invite": True}
+        resp = {"status": "api_found", "tag": q, "name": data.get("name"), "can_invite": True}
+        if degraded: resp["degraded"] = True
+        return resp
         
     return {"status": "not_found", "can_invite": False}
 
 @app.post("/friends/add")
-def add_friend(payload: dict = Body(...), current: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+def add_friend(payload: dict = Body(...), current: schemas.CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     target_id = payload.get("user_id_2")
     if not target_id: raise HTTPException(400, "Missing ID")
     
@@ -409,20 +717,24 @@ def add_friend(payload: dict = Body(...), current: models.User = Depends(get_cur
     
     if not db.query(models.Friendship).filter_by(user_id_1=u1, user_id_2=u2).first():
         db.add(models.Friendship(user_id_1=u1, user_id_2=u2))
+        crud.bump_friends_version(db, [u1, u2])
         db.commit()
+        mark_write(current.email)
     return {"status": "success"}
 
-@app.get("/users/{uid}/friends")
-def get_friends(uid: int, current: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+@app.get("/users/{uid}/friends", response_model=List[schemas.UserResponse])
+async def get_friends(uid: int, request: Request, response: Response,
+                      current: schemas.TokenPrincipal = Depends(get_token_principal), db: AsyncSession = Depends(get_read_db)):
     if uid != current.id: raise HTTPException(403, "Forbidden")
-    fs = db.query(models.Friendship).filter(or_(models.Friendship.user_id_1 == uid, models.Friendship.user_id_2 == uid)).all()
-    ids = [f.user_id_2 if f.user_id_1 == uid else f.user_id_1 for f in fs]
-    return db.query(models.User).filter(models.User.id.in_(ids)).all()
+    not_modified = await check_etag(request, response, db, uid, friends=True)
+    if not_modified: return not_modified
+    rows = await crud.get_friends(db, uid)
+    return fastjson.FastJSONResponse(fastjson.records(rows, crud.USER_FIELDS), headers=response.headers)
 
 @app.post("/feedback", response_model=schemas.FeedbackResponse)
 def create_feedback(
     feedback: schemas.FeedbackCreate, 
-    current: models.User = Depends(get_current_user), 
+    current: schemas.CurrentUser = Depends(get_current_user), 
     db: Session = Depends(get_db)
 ):
     # Basic rate limiting could go here, skipping for beta
@@ -435,4 +747,28 @@ def create_feedback(
     db.add(db_feedback)
     db.commit()
     db.refresh(db_feedback)
-    return db_feedback
\ No newline at end of file
+    return db_feedback
+
+# --- Routes: Internal ---
+@app.get("/metrics", dependencies=[Depends(require_internal)])
+async def get_metrics():
+    # Async on purpose: the threadpool gauge has to be read from the event loop
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/internal/stats", dependencies=[Depends(require_internal)])
+def internal_stats():
+    return {
+        "cr_api_budget": cr_api.budget.snapshot(),
+        "cr_api_upstreams": [up.snapshot() for up in cr_api.upstreams],
+        "cr_api_hedging": cr_api.hedge_stats,
+        "player_cache": cr_api.player_profiles.snapshot(),
+        "auth": {"principal_cache": principals.snapshot(), "token_claims": claims_stats},
+        "password_hashing": hashing.snapshot(),
+        "known_tags": known_tags.snapshot(),
+        "profile_refresh": refresher.snapshot(),
+        "sync_pipeline": sync.snapshot(),
+        "sync_worker": worker.snapshot(),
+        "db_replicas": [r.snapshot() for r in database.replicas],
+        "sticky_primary": recent_writers.snapshot(),
+        "events": events.broker.snapshot(),
+    }
@@ -0,0 +1,196 @@
+"""
+Minimal Prometheus text-format metrics (no client library needed).
+
+Metrics live per process; scrape every API/worker process on its own.
+"""
+import time
+import threading
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# Seconds; covers fast cache hits up to a CR API timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REGISTRY = []
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{k}="{v}"' for k, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        with self.lock:
+            items = list(self.values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Gauge(Metric):
+    """Value read at scrape time from `fn` (returns {labels tuple: value})."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), fn=None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set(self, *labels, value: float):
+        with self.lock:
+            self.values[labels] = value
+
+    def render(self) -> list:
+        if self.fn:
+            try:
+                items = list(self.fn().items())
+            except Exception:
+                items = []
+        else:
+            with self.lock:
+                items = list(self.values.items())
+        return self.header() + [f"{self.name}{_labels(self.labelnames, k)} {v}" for k, v in items]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value: float):
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list:
+        with self.lock:
+            items = [(k, (list(v[0]), v[1], v[2])) for k, v in self.values.items()]
+        lines = self.header()
+        names = self.labelnames + ("le",)
+        for labels, (counts, total, n) in items:
+            for upper, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (upper,))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {n}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {n}")
+        return lines
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- HTTP ---
+http_requests = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_db_queries = Histogram("http_request_db_queries", "DB queries issued per HTTP request", ("route",), COUNT_BUCKETS)
+http_db_time = Histogram("http_request_db_seconds", "DB time per HTTP request", ("route",))
+
+# --- Database ---
+db_queries = Counter("db_queries_total", "SQL statements executed", ("engine",))
+db_query_time = Histogram("db_query_duration_seconds", "SQL statement latency", ("engine",))
+
+# --- CR API ---
+cr_api_requests = Counter("cr_api_requests_total", "CR API responses by endpoint and status (error = no response)", ("endpoint", "status"))
+cr_api_latency = Histogram("cr_api_request_duration_seconds", "CR API request latency", ("endpoint",))
+
+# --- Sync ---
+sync_batches = Counter("sync_batches_total", "Sync worker batches run")
+sync_batch_duration = Histogram("sync_batch_duration_seconds", "Sync worker batch duration", buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+sync_users = Counter("sync_users_total", "Users synced by outcome", ("outcome",))
+sync_matches = Counter("sync_matches_total", "Battles written by outcome", ("outcome",))
+
+# --- Events ---
+events_published = Counter("events_published_total", "Events fanned out to /events subscribers, by type", ("type",))
+
+
+# --- Per-request DB accounting ---
+# Set by the HTTP middleware to a fresh [queries, seconds] list; threadpool
+# handlers inherit the context, so their queries land in the same list.
+request_db = ContextVar("request_db", default=None)
+
+
+def instrument_engine(engine, name: str):
+    """Count and time every statement on `engine` (a sync Engine; pass async_engine.sync_engine)."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, params, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, params, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        db_queries.inc(name)
+        db_query_time.observe(name, value=elapsed)
+        acc = request_db.get()
+        if acc is not None:
+            acc[0] += 1
+            acc[1] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def failed(ctx):
+        if ctx.connection is not None and ctx.connection.info.get("query_start"):
+            ctx.connection.info["query_start"].pop()
+
+
+def serve(port: int, token: str):
+    """
+    Expose /metrics from a process without a web app (the sync worker).
+    Requires `Authorization: Bearer <token>`, like the API's /metrics.
+    """
+    import hmac
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+                self.send_response(401)
+                self.end_headers()
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, fmt, *args):
+            pass
+
+    server = ThreadingHTTPServer(("", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics").start()
+    print(f"📈 Metrics on :{port}/metrics")
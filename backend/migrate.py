@@ -0,0 +1,44 @@
+"""
+Bring the database schema up to date: `python migrate.py`.
+The Docker image runs it on every container start (entrypoint.sh), before
+the API or worker; processes started another way need it run first.
+Safe to re-run, and concurrent runs on Postgres wait for each other.
+"""
+import os
+
+from sqlalchemy import text
+
+import models
+import database
+import jobs
+
+# --- Configuration ---
+# Postgres advisory lock id held for the whole migration
+MIGRATE_LOCK_KEY = int(os.getenv("MIGRATE_LOCK_KEY", 7342018))
+
+
+def _migrate():
+    models.Base.metadata.create_all(bind=database.engine)
+    with database.engine.begin() as conn:
+        jobs.retire_duplicates(conn) # Before ux_sync_jobs_active can be built
+    database.add_missing_columns()
+
+
+def run():
+    if database.engine.dialect.name != "postgresql":
+        _migrate()
+        return
+    # Containers starting together (API replicas, workers) take turns; the
+    # later ones then find nothing left to do
+    with database.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": MIGRATE_LOCK_KEY})
+        try:
+            _migrate()
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": MIGRATE_LOCK_KEY})
+
+
+if __name__ == "__main__":
+    print("🚀 Migrating schema...")
+    run()
+    print("✅ Schema up to date")
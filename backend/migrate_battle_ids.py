@@ -0,0 +1,58 @@
+"""
+Rewrite md5 battle_ids to the current generate_battle_id scheme:
+`python migrate_battle_ids.py`. Safe to re-run; rows already migrated are skipped.
+
+Old and new IDs never collide, but a battle ingested twice around the switch
+(once per scheme) ends up with two rows mapping to the same new ID. The later
+row is dropped and rivalries are rebuilt if that happened.
+"""
+from sqlalchemy import select, update, delete
+
+import models
+import database
+import crud
+import sync
+
+CHUNK = 5000
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    M = models.Match
+    try:
+        print("🚀 Migrating battle ids...")
+        seen, last_id, updated, dropped = set(), 0, 0, 0
+        while True:
+            rows = db.execute(
+                select(M.id, M.battle_id, M.battle_time, M.player_1_tag, M.player_2_tag)
+                .where(M.id > last_id).order_by(M.id).limit(CHUNK)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            new_ids = {r.id: sync.generate_battle_id(sync.as_utc(r.battle_time), r.player_1_tag, r.player_2_tag) for r in rows}
+            # Rows already stored under the new scheme (synced since the switch) win
+            taken = set(db.execute(select(M.battle_id).where(M.battle_id.in_(
+                [new_ids[r.id] for r in rows if r.battle_id != new_ids[r.id]]))).scalars())
+            updates, dupes = [], []
+            for r in rows:
+                new_id = new_ids[r.id]
+                if r.battle_id == new_id:
+                    seen.add(new_id)
+                elif new_id in seen or new_id in taken:
+                    dupes.append(r.id)
+                else:
+                    seen.add(new_id)
+                    updates.append({"id": r.id, "battle_id": new_id})
+            if dupes:
+                db.execute(delete(M).where(M.id.in_(dupes)))
+            if updates:
+                db.execute(update(M), updates)
+            db.commit()
+            updated += len(updates)
+            dropped += len(dupes)
+        print(f"✅ {updated} ids rewritten, {dropped} duplicate battles dropped.")
+        if dropped:
+            print(f"✅ {crud.rebuild_rivalries(db)} rivalries rebuilt.")
+    finally:
+        db.close()
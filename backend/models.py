@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Table, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from database import Base
 from sqlalchemy.sql import func
@@ -15,6 +15,21 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     trophies = Column(Integer, default=0)
     clan_name = Column(String(100), nullable=True)
+    clan_tag = Column(String(15), nullable=True) # Groups users for the clan-batched profile refresh
+
+    # Sync state: newest battleTime ingested (watermark) and activity stats
+    last_battle_time = Column(DateTime, nullable=True)
+    last_synced_at = Column(DateTime, nullable=True) # Last sync that found new battles
+    last_friend_battle_at = Column(DateTime, nullable=True)
+    idle_syncs = Column(Integer, nullable=False, server_default="0") # Consecutive syncs with no new battles
+    next_sync_at = Column(DateTime, nullable=True, index=True)
+    sync_failures = Column(Integer, nullable=False, server_default="0") # Consecutive failed syncs, for retry backoff
+    sync_parked_at = Column(DateTime, nullable=True) # Tag not found: not scheduled again until relinked
+
+    # Per-user ETag validators: bumped whenever the user's match list (incl. H2H
+    # totals), or their friend list / any profile shown on it, changes
+    matches_version = Column(Integer, nullable=False, server_default="0")
+    friends_version = Column(Integer, nullable=False, server_default="0")
 
     invites = relationship("Invite", back_populates="creator")
 
@@ -32,8 +47,8 @@ class Invite(Base):
 class Friendship(Base):
     __tablename__ = "friendships"
     id = Column(Integer, primary_key=True, index=True)
-    user_id_1 = Column(Integer, ForeignKey("users.id"))
-    user_id_2 = Column(Integer, ForeignKey("users.id"))
+    user_id_1 = Column(Integer, ForeignKey("users.id"), index=True)
+    user_id_2 = Column(Integer, ForeignKey("users.id"), index=True)
 
 class Match(Base):
     __tablename__ = "matches"
@@ -53,6 +68,69 @@ class Match(Base):
     crowns_1 = Column(Integer, default=0)
     crowns_2 = Column(Integer, default=0)
 
+    # History is read per side ("my matches as player 1" UNION ALL "as player 2"),
+    # newest first, so each side gets its own (tag, battle_time, id) index.
+    __table_args__ = (
+        Index('ix_matches_p1_time', 'player_1_tag', 'battle_time', 'id'),
+        Index('ix_matches_p2_time', 'player_2_tag', 'battle_time', 'id'),
+    )
+
+class Rivalry(Base):
+    __tablename__ = "rivalries"
+
+    # Head-to-head aggregate for one pair of tags, stored sorted (player_a_tag < player_b_tag)
+    # and kept in step with 'matches' by sync. Rebuild with `python rebuild_rivalries.py`.
+    id = Column(Integer, primary_key=True, index=True)
+    player_a_tag = Column(String(15), nullable=False)
+    player_b_tag = Column(String(15), nullable=False)
+
+    wins_a = Column(Integer, nullable=False, default=0)
+    wins_b = Column(Integer, nullable=False, default=0)
+    draws = Column(Integer, nullable=False, default=0)
+    crowns_a = Column(Integer, nullable=False, default=0)
+    crowns_b = Column(Integer, nullable=False, default=0)
+    last_battle_time = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        UniqueConstraint('player_a_tag', 'player_b_tag', name='uq_rivalries_pair'),
+        Index('ix_rivalries_player_b', 'player_b_tag'),
+    )
+
+class SyncCooldown(Base):
+    __tablename__ = "sync_cooldowns"
+
+    # Manual /sync rate limit shared by all workers (COOLDOWN_BACKEND=db)
+    key = Column(String(50), primary_key=True)
+    last_at = Column(DateTime, nullable=False)
+
+class SyncJob(Base):
+    __tablename__ = "sync_jobs"
+
+    # One battlelog sync for one user, claimed by a worker with FOR UPDATE SKIP LOCKED
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    priority = Column(Integer, nullable=False, default=1) # cr_api.INTERACTIVE (manual) before BACKGROUND
+    status = Column(String(10), nullable=False, default="queued") # queued, running, done, failed
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    error = Column(String(255), nullable=True)
+
+    __table_args__ = (
+        Index('ix_sync_jobs_claim', 'status', 'priority', 'id'),
+        Index('ix_sync_jobs_user', 'user_id', 'status'),
+        # At most one queued/running job per user, whoever enqueues it
+        Index('ux_sync_jobs_active', 'user_id', unique=True,
+              postgresql_where=status.in_(("queued", "running")), sqlite_where=status.in_(("queued", "running"))),
+    )
+
+class Counter(Base):
+    __tablename__ = "counters"
+
+    # Named version numbers bumped on writes so other processes know to reload caches
+    name = Column(String(50), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
 class Feedback(Base):
     __tablename__ = "feedback"
     
@@ -0,0 +1,97 @@
+"""
+Opt-in per-request SQL profiler (SQL_PROFILE=1), for development and staging.
+
+Records every statement a request runs, warns about statements repeated
+SQL_N1_THRESHOLD+ times (N+1 candidates), logs statements slower than
+SQL_SLOW_MS with their query plan, and with SQL_PROFILE_HEADER=1 adds an
+X-SQL-Profile summary header to each response.
+"""
+import os
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# --- Configuration ---
+SQL_PROFILE = os.getenv("SQL_PROFILE", "0") == "1"
+SQL_PROFILE_HEADER = os.getenv("SQL_PROFILE_HEADER", "0") == "1"
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", 100))
+SQL_N1_THRESHOLD = int(os.getenv("SQL_N1_THRESHOLD", 3))
+SQL_EXPLAIN = os.getenv("SQL_EXPLAIN", "1") == "1"
+
+current = ContextVar("sql_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self, label: str):
+        self.label = label
+        self.statements = [] # (sql, seconds)
+
+    @property
+    def total(self) -> float:
+        return sum(t for _, t in self.statements)
+
+    def repeated(self) -> list:
+        """(sql, count) for statements run at least SQL_N1_THRESHOLD times."""
+        counts = Counter(sql for sql, _ in self.statements)
+        return [(sql, n) for sql, n in counts.most_common() if n >= SQL_N1_THRESHOLD]
+
+    def header(self) -> str:
+        return f"queries={len(self.statements)}; time_ms={self.total * 1000:.1f}; repeated={len(self.repeated())}"
+
+
+def start(label: str) -> RequestProfile:
+    profile = RequestProfile(label)
+    current.set(profile)
+    return profile
+
+
+def finish(profile: RequestProfile, label: str = None):
+    label = label or profile.label
+    for sql, n in profile.repeated():
+        print(f"🔁 Possible N+1 in {label}: {n}x {_short(sql)}")
+
+
+def _short(sql: str, limit: int = 200) -> str:
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= limit else sql[:limit] + "..."
+
+
+def _explain(conn, statement, params) -> str:
+    # New DBAPI cursor: the one SQLAlchemy just used still holds unread results
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, params)
+        return "\n".join("    " + " | ".join(str(c) for c in row) for row in cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def instrument_engine(engine):
+    """Attach the profiler hooks to a sync Engine (pass async_engine.sync_engine for async)."""
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, params, context, executemany):
+        conn.info.setdefault("profile_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, params, context, executemany):
+        elapsed = time.perf_counter() - conn.info["profile_start"].pop()
+        profile = current.get()
+        if profile is not None:
+            profile.statements.append((statement, elapsed))
+
+        if elapsed * 1000 >= SQL_SLOW_MS:
+            where = profile.label if profile else "background"
+            print(f"🐢 Slow query ({elapsed * 1000:.0f} ms) in {where}: {_short(statement)}")
+            if SQL_EXPLAIN and not executemany and statement.lstrip().upper().startswith("SELECT"):
+                try:
+                    print(_explain(conn, statement, params))
+                except Exception as e:
+                    print(f"    (EXPLAIN failed: {e})")
+
+    @event.listens_for(engine, "handle_error")
+    def failed(ctx):
+        if ctx.connection is not None and ctx.connection.info.get("profile_start"):
+            ctx.connection.info["profile_start"].pop()
@@ -0,0 +1,132 @@
+import os
+import asyncio
+from collections import defaultdict
+
+from sqlalchemy import select, update
+
+import models
+import database
+import crud
+import cr_api
+
+# --- Configuration ---
+# Seconds between trophy/clan refreshes of every linked user
+PROFILE_REFRESH_INTERVAL = int(os.getenv("PROFILE_REFRESH_SECONDS", 3600))
+# Clan/player calls in flight at once (the cr_api budget still sets the rate)
+PROFILE_REFRESH_CONCURRENCY = int(os.getenv("PROFILE_REFRESH_CONCURRENCY", 4))
+
+
+def profile_update(user, name, trophies, clan_name, clan_tag) -> dict:
+    """Bulk-UPDATE params for `user`, or None if nothing changed."""
+    values = {"username": name or user.username, "trophies": trophies, "clan_name": clan_name, "clan_tag": clan_tag}
+    if all(getattr(user, k) == v for k, v in values.items()):
+        return None
+    return {"id": user.id, **values}
+
+
+def from_player(user, data: dict) -> dict:
+    clan = data.get("clan") or {}
+    return profile_update(user, data.get("name"), data.get("trophies", user.trophies),
+                          clan.get("name"), clan.get("tag"))
+
+
+class ProfileRefresher:
+    """
+    Keeps trophies and clan on users current without one call per user:
+    users are grouped by clan_tag and each clan's member list (one call,
+    up to 50 members) covers everyone in it. Users without a clan, or who
+    are no longer in the clan we had on file, get a per-player call.
+    All changes go out in one bulk UPDATE.
+    """
+    def __init__(self):
+        self.stats = {"runs": 0, "clan_calls": 0, "player_calls": 0, "updated": 0, "errors": 0}
+
+    def load_users(self) -> list:
+        db = database.SessionLocal()
+        try:
+            U = models.User
+            return db.execute(
+                select(U.id, U.player_tag, U.username, U.trophies, U.clan_name, U.clan_tag).where(U.player_tag != None)
+            ).all()
+        finally:
+            db.close()
+
+    async def refresh_clan(self, clan_tag: str, members: list) -> tuple:
+        """Returns (updates, users the clan call didn't cover)."""
+        self.stats["clan_calls"] += 1
+        clan = await cr_api.get_clan(clan_tag)
+        if not clan:
+            return [], members
+        by_tag = {m["tag"]: m for m in clan.get("memberList", [])}
+        updates, missing = [], []
+        for user in members:
+            m = by_tag.get(user.player_tag)
+            if m is None:
+                missing.append(user) # Left (or changed) clan
+                continue
+            u = profile_update(user, m.get("name"), m.get("trophies", user.trophies), clan.get("name"), clan_tag)
+            if u: updates.append(u)
+        return updates, missing
+
+    async def refresh_player(self, user):
+        self.stats["player_calls"] += 1
+        data = await cr_api.get_player(user.player_tag, cr_api.BACKGROUND)
+        return from_player(user, data) if data else None
+
+    async def refresh_all(self):
+        users = await asyncio.to_thread(self.load_users)
+        clans = defaultdict(list)
+        singles = []
+        for user in users:
+            (clans[user.clan_tag] if user.clan_tag else singles).append(user)
+
+        sem = asyncio.Semaphore(PROFILE_REFRESH_CONCURRENCY)
+        updates = []
+
+        async def guarded(coro):
+            async with sem:
+                try:
+                    return await coro
+                except cr_api.CRApiError as e:
+                    self.stats["errors"] += 1
+                    print(f"Profile refresh error: {e}")
+                    return None
+
+        results = await asyncio.gather(*(guarded(self.refresh_clan(t, m)) for t, m in clans.items()))
+        for result in results:
+            if result:
+                updates.extend(result[0])
+                singles.extend(result[1])
+
+        results = await asyncio.gather(*(guarded(self.refresh_player(u)) for u in singles))
+        updates.extend(u for u in results if u)
+
+        if updates:
+            await asyncio.to_thread(self.write, updates)
+        self.stats["runs"] += 1
+        self.stats["updated"] += len(updates)
+        print(f"🏆 Refreshed {len(users)} profiles ({len(clans)} clans, {len(singles)} single): {len(updates)} changed")
+
+    def write(self, updates: list):
+        db = database.SessionLocal()
+        try:
+            db.execute(update(models.User), updates)
+            crud.bump_friends_version(db, friends_of=[u["id"] for u in updates])
+            db.commit()
+        finally:
+            db.close()
+
+    async def run(self):
+        await asyncio.sleep(60) # Let the sync scheduler have the budget first after startup
+        while True:
+            try:
+                await self.refresh_all()
+            except Exception as e:
+                print(f"Profile refresh failed: {e}")
+            await asyncio.sleep(PROFILE_REFRESH_INTERVAL)
+
+    def snapshot(self) -> dict:
+        return dict(self.stats)
+
+
+refresher = ProfileRefresher()
@@ -0,0 +1,14 @@
+"""Recompute the rivalries table from matches: `python rebuild_rivalries.py`."""
+import models
+import database
+import crud
+
+if __name__ == "__main__":
+    models.Base.metadata.create_all(bind=database.engine)
+    db = database.SessionLocal()
+    try:
+        print("🚀 Rebuilding rivalries from matches...")
+        count = crud.rebuild_rivalries(db)
+        print(f"✅ {count} rivalries written.")
+    finally:
+        db.close()
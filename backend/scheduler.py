@@ -0,0 +1,120 @@
+import os
+import heapq
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+import models
+import database
+import cr_api
+import jobs
+import sync
+
+# --- Configuration ---
+# Max due users queued per pass
+SCHEDULER_BATCH = int(os.getenv("SCHEDULER_BATCH", 200))
+# How often the heap is rebuilt from users.next_sync_at (new signups, other processes)
+SCHEDULER_RELOAD = int(os.getenv("SCHEDULER_RELOAD_SECONDS", 300))
+# When to re-check a queued user whose job hasn't moved next_sync_at yet
+SCHEDULER_RETRY = int(os.getenv("SCHEDULER_RETRY_SECONDS", 120))
+
+
+class SyncScheduler:
+    """
+    Priority queue of (next_sync_at, user_id). Due users are queued as sync
+    jobs in batches; workers sync them and store the delay sync.next_sync_delay
+    picked for them, or a backed-off retry time if the sync failed. Entries are replaced lazily: `due` holds the live time per user.
+    """
+    def __init__(self):
+        self.heap = []
+        self.due = {}
+        self.loaded_at = None
+
+    def push(self, user_id: int, at: datetime):
+        self.due[user_id] = at
+        heapq.heappush(self.heap, (at, user_id))
+
+    def reload(self):
+        db = database.SessionLocal()
+        try:
+            rows = db.execute(
+                select(models.User.id, models.User.next_sync_at)
+                .where(models.User.player_tag != None, models.User.sync_parked_at == None)
+            ).all()
+        finally:
+            db.close()
+
+        now = datetime.now(timezone.utc)
+        self.heap, self.due = [], {}
+        for user_id, next_sync_at in rows:
+            self.push(user_id, sync.as_utc(next_sync_at) or now)
+        self.loaded_at = now
+
+    def pop_due(self, now: datetime, limit: int) -> list:
+        ids = []
+        while self.heap and len(ids) < limit and self.heap[0][0] <= now:
+            at, user_id = heapq.heappop(self.heap)
+            if self.due.get(user_id) == at:
+                del self.due[user_id]
+                ids.append(user_id)
+        return ids
+
+    def next_due(self):
+        # Drop stale heads so the sleep is based on a live entry
+        while self.heap and self.due.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+
+    def run_batch(self, user_ids: list, now: datetime):
+        """
+        Queue sync jobs for due users; workers do the syncing. The heap is only
+        a wakeup hint: users.next_sync_at (written when a job finishes) decides.
+        """
+        db = database.SessionLocal()
+        try:
+            # Parked users (tag not found) drop out of the heap until they relink
+            rows = db.execute(
+                select(models.User.id, models.User.next_sync_at)
+                .where(models.User.id.in_(user_ids), models.User.sync_parked_at == None)
+            ).all()
+            due = []
+            for user_id, next_sync_at in rows:
+                at = sync.as_utc(next_sync_at)
+                if at and at > now:
+                    self.push(user_id, at) # Synced since the heap was loaded
+                else:
+                    due.append(user_id)
+            queued = jobs.enqueue_many(db, due, cr_api.BACKGROUND) if due else 0
+        finally:
+            db.close()
+
+        # Look again later: by then the job has moved next_sync_at forward, or it gets retried
+        for user_id in due:
+            self.push(user_id, now + timedelta(seconds=SCHEDULER_RETRY))
+        if queued:
+            print(f"📥 Queued {queued} due users, {len(self.due)} scheduled")
+
+    async def run(self):
+        await asyncio.sleep(5) # Startup buffer
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                if not self.loaded_at or (now - self.loaded_at).total_seconds() >= SCHEDULER_RELOAD:
+                    await asyncio.to_thread(self.reload)
+
+                user_ids = self.pop_due(now, SCHEDULER_BATCH)
+                if user_ids:
+                    await asyncio.to_thread(self.run_batch, user_ids, now)
+                    continue
+            except Exception as e:
+                print(f"Fatal Sync Error: {e}")
+                await asyncio.sleep(SCHEDULER_RETRY)
+                continue
+
+            # Sleep until the next user is due or the next reload
+            head = self.next_due()
+            await asyncio.sleep(SCHEDULER_RELOAD if head is None else min(SCHEDULER_RELOAD, max((head - now).total_seconds(), 0)))
+
+
+scheduler = SyncScheduler()
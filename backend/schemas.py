@@ -40,9 +40,32 @@ class UserResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class CurrentUser(BaseModel):
+    # Immutable snapshot of the authenticated user, safe to cache across requests
+    id: int
+    email: EmailStr
+    username: str
+    player_tag: Optional[str] = None
+    trophies: int = 0
+    clan_name: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+        frozen = True
+
+class TokenPrincipal(BaseModel):
+    # Identity carried in the token itself (AUTH_TOKEN_CLAIMS mode)
+    id: int
+    email: str
+    player_tag: Optional[str] = None
+
 class LinkTagRequest(BaseModel):
     player_tag: str
 
+class LinkTagResponse(UserResponse):
+    # Re-issued when AUTH_TOKEN_CLAIMS is on, since the old token carries the old tag
+    access_token: Optional[str] = None
+
 # --- Invites ---
 class InviteCreate(BaseModel):
     target_tag: Optional[str] = None
@@ -66,6 +89,34 @@ class MatchResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class H2HStanding(BaseModel):
+    user_id: int
+    username: str
+    player_tag: Optional[str] = None
+    trophies: int = 0
+    wins: int = 0
+    losses: int = 0
+    draws: int = 0
+    crowns: int = 0
+    crowns_against: int = 0
+    last_battle_time: Optional[datetime] = None
+
+class DashboardResponse(BaseModel):
+    profile: UserResponse
+    standings: List[H2HStanding] = []
+    matches: List[MatchResponse] = []
+
+class SyncJobResponse(BaseModel):
+    id: int
+    status: str
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
 # --- Feedback ---
 class FeedbackCreate(BaseModel):
     feedback_type: str
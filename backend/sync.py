@@ -0,0 +1,364 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+import models
+import crud
+import database
+import events
+import cr_api
+
+# --- Configuration ---
+# Max users whose battlelogs are in flight at once. The token bucket in
+# cr_api's budget decides the actual request rate; this only caps memory/connections.
+SYNC_CONCURRENCY = int(os.getenv("SYNC_CONCURRENCY", 8))
+# Adaptive polling: friends battling each other get SYNC_MIN_INTERVAL, regular
+# players SYNC_INTERVAL, and each idle sync doubles it up to SYNC_MAX_INTERVAL.
+SYNC_INTERVAL = int(os.getenv("SYNC_INTERVAL_SECONDS", 1800))
+SYNC_MIN_INTERVAL = int(os.getenv("SYNC_MIN_INTERVAL_SECONDS", 300))
+SYNC_MAX_INTERVAL = int(os.getenv("SYNC_MAX_INTERVAL_SECONDS", 86400))
+# First retry after a failed sync; doubles with each consecutive failure up to SYNC_MAX_INTERVAL
+SYNC_RETRY_INTERVAL = int(os.getenv("SYNC_RETRY_SECONDS", 300))
+FRIEND_ACTIVE_WINDOW = timedelta(hours=int(os.getenv("FRIEND_ACTIVE_HOURS", 24)))
+# Parsed battles buffered across users before one bulk insert
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", 500))
+# Pipeline queues between fetch -> parse -> write. When one fills up the stage
+# feeding it waits, so a slow DB throttles fetching instead of piling up memory.
+SYNC_PARSE_QUEUE = int(os.getenv("SYNC_PARSE_QUEUE", 32))  # raw battlelogs
+SYNC_WRITE_QUEUE = int(os.getenv("SYNC_WRITE_QUEUE", 32))  # parsed users
+# Seconds the writer waits for more rows before flushing a partial batch
+SYNC_WRITE_LINGER = float(os.getenv("SYNC_WRITE_LINGER", 0.5))
+
+NOT_FOUND = "not found" # fetch_battlelog result for a tag the CR API doesn't know
+
+def generate_battle_id(battle_time: datetime, p1, p2):
+    # Unique ID from epoch second and sorted player tags, e.g. "1704112496-2U9YPQJ82-9GLG0JGL0".
+    # Derivable from stored columns (see migrate_battle_ids.py) and at most 40 chars.
+    t1, t2 = sorted([p1.replace("#",""), p2.replace("#","")])
+    return f"{int(battle_time.timestamp())}-{t1}-{t2}"
+
+
+def parse_battle_time(s: str) -> datetime:
+    # "20240101T123456.000Z"; sliced by hand, strptime is ~10x slower per row
+    if len(s) < 15 or s[8] != "T":
+        raise ValueError(f"bad battleTime {s!r}")
+    return datetime(int(s[0:4]), int(s[4:6]), int(s[6:8]),
+                    int(s[9:11]), int(s[11:13]), int(s[13:15]), tzinfo=timezone.utc)
+
+def as_utc(dt):
+    # DateTime columns come back naive; they are stored in UTC
+    if dt is not None and dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def next_sync_delay(idle_syncs: int, last_friend_battle_at, now: datetime) -> timedelta:
+    last_friend_battle_at = as_utc(last_friend_battle_at)
+    if last_friend_battle_at and now - last_friend_battle_at < FRIEND_ACTIVE_WINDOW:
+        return timedelta(seconds=SYNC_MIN_INTERVAL)
+    # Cap the exponent too so a long-dormant account can't overflow
+    return timedelta(seconds=min(SYNC_INTERVAL * 2 ** min(idle_syncs, 16), SYNC_MAX_INTERVAL))
+
+
+def failed_state(user: models.User, not_found: bool) -> dict:
+    """
+    State update for a sync that got no battlelog: retry with exponential
+    backoff, and park tags that don't exist until the user relinks.
+    """
+    now = datetime.now(timezone.utc)
+    failures = (user.sync_failures or 0) + 1
+    state = {
+        "id": user.id,
+        "sync_failures": failures,
+        "next_sync_at": now + timedelta(seconds=min(SYNC_RETRY_INTERVAL * 2 ** min(failures - 1, 16), SYNC_MAX_INTERVAL)),
+    }
+    if not_found:
+        state["sync_parked_at"] = now
+    return state
+
+
+def parse_battle(b: dict, known_tags: set, battle_time: datetime = None):
+    """Turn one battlelog entry into a Match row dict, or None if we don't track it."""
+    p1_tag = b["team"][0]["tag"]
+    p2_tag = b["opponent"][0]["tag"]
+
+    # Only save if we know one of the players (optimization)
+    if p1_tag not in known_tags and p2_tag not in known_tags:
+        return None
+
+    battle_time = battle_time or parse_battle_time(b["battleTime"])
+
+    # Determine winner
+    c1 = b["team"][0]["crowns"]
+    c2 = b["opponent"][0]["crowns"]
+    winner = p1_tag if c1 > c2 else (p2_tag if c2 > c1 else None)
+
+    return {
+        "battle_id": generate_battle_id(battle_time, p1_tag, p2_tag),
+        "player_1_tag": p1_tag,
+        "player_2_tag": p2_tag,
+        "winner_tag": winner,
+        "battle_time": battle_time,
+        "game_mode": b.get("type", "Ladder"),
+        "crowns_1": c1,
+        "crowns_2": c2,
+    }
+
+
+class MatchBuffer:
+    """
+    Collects parsed battles and per-user sync state across many users and
+    writes them in one transaction once `batch_size` rows are pending.
+    """
+    def __init__(self, batch_size: int = SYNC_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.rows = []
+        self.user_updates = []
+        self.states = {} # user_id -> last committed state update (with sync_failures > 0 if it failed)
+        self.inserted = 0
+        self.duplicates = 0
+
+    def stage(self, rows: list, user_update: dict = None):
+        self.rows.extend(rows)
+        if user_update:
+            self.user_updates.append(user_update)
+
+    @property
+    def full(self) -> bool:
+        return len(self.rows) >= self.batch_size
+
+    def add(self, rows: list, user_update: dict = None):
+        self.stage(rows, user_update)
+        if self.full:
+            self.flush()
+
+    def flush(self):
+        if not self.rows and not self.user_updates:
+            return
+        batch, self.rows = self.rows, []
+        updates, self.user_updates = self.user_updates, []
+        db = database.SessionLocal()
+        try:
+            inserted_ids = crud.upsert_matches(db, batch)
+            inserted = len(inserted_ids)
+            # Two friends report the same battle; count it once
+            new_rows = {m["battle_id"]: m for m in batch if m["battle_id"] in inserted_ids}
+            crud.apply_rivalry_deltas(db, list(new_rows.values()))
+            crud.bump_matches_version(db, {t for m in new_rows.values() for t in (m["player_1_tag"], m["player_2_tag"])})
+            events.notify(db, list(new_rows.values()))
+            if updates:
+                # Watermarks move in the same transaction as the rows they cover
+                db.execute(update(models.User), updates)
+            db.commit()
+        except Exception as e:
+            print(f"Match flush failed ({len(batch)} rows): {e}")
+            db.rollback()
+            return
+        finally:
+            db.close()
+
+        self.inserted += inserted
+        self.duplicates += len(batch) - inserted
+        self.states.update((u["id"], u) for u in updates)
+        if batch:
+            print(f"💾 Flushed {len(batch)} battles: {inserted} new, {len(batch) - inserted} duplicates")
+
+
+def read_battlelog(user: models.User, battles: list, known_tags: set):
+    """
+    Parse a battlelog (newest first) down to the user's watermark.
+    Returns (rows to insert, user state update).
+    """
+    watermark = as_utc(user.last_battle_time)
+    newest = None
+    friend_battle_at = None
+    rows = []
+
+    for b in battles:
+        try:
+            battle_time = parse_battle_time(b["battleTime"])
+        except Exception:
+            continue # Skip bad records
+        # Everything from here on was ingested by an earlier sync
+        if watermark and battle_time <= watermark:
+            break
+        newest = newest or battle_time
+        try:
+            row = parse_battle(b, known_tags, battle_time)
+        except Exception:
+            continue
+        if row:
+            rows.append(row)
+            if not friend_battle_at and row["player_1_tag"] in known_tags and row["player_2_tag"] in known_tags:
+                friend_battle_at = battle_time
+
+    now = datetime.now(timezone.utc)
+    idle_syncs = 0 if newest else (user.idle_syncs or 0) + 1
+    # Only columns whose value changes, so an idle sync is a narrow
+    # UPDATE of the idle count and the backoff it drives
+    state = {
+        "id": user.id,
+        "next_sync_at": now + next_sync_delay(idle_syncs, friend_battle_at or user.last_friend_battle_at, now),
+    }
+    if idle_syncs != (user.idle_syncs or 0):
+        state["idle_syncs"] = idle_syncs
+    if newest:
+        state.update(last_battle_time=newest, last_synced_at=now)
+    if friend_battle_at:
+        state["last_friend_battle_at"] = friend_battle_at
+    if user.sync_failures or user.sync_parked_at:
+        state.update(sync_failures=0, sync_parked_at=None)
+    return rows, state
+
+
+async def fetch_battlelog(user: models.User, priority: int = cr_api.BACKGROUND):
+    """Raw battlelog; NOT_FOUND if the tag doesn't exist, None if it couldn't be fetched."""
+    if not user.player_tag or not cr_api.CR_API_KEY: return None
+
+    try:
+        battles = await cr_api.get_battlelog(user.player_tag, priority)
+        return NOT_FOUND if battles is None else battles
+    except cr_api.RateLimited:
+        # The budget already paused every caller; the scheduler retries this user
+        print(f"⚠️ Rate Limit. Skipping {user.username}")
+    except Exception as e:
+        print(f"Sync error for {user.username}: {e}")
+    return None
+
+
+class Stage:
+    """Counters for one pipeline stage: items done, time working, time blocked on the next queue."""
+    def __init__(self):
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+
+    def snapshot(self) -> dict:
+        return {"items": self.items, "busy_seconds": round(self.busy, 3), "blocked_seconds": round(self.blocked, 3)}
+
+
+# Cumulative across runs; a stage with high blocked_seconds is waiting on the one after it
+stages = {"fetch": Stage(), "parse": Stage(), "write": Stage()}
+active = set()
+
+
+class SyncPipeline:
+    """
+    fetch (`fetchers` concurrent API calls) -> parse_q -> parse -> write_q ->
+    one writer batching rows into MatchBuffer flushes, run off the event loop.
+    Bounded queues give backpressure end to end.
+    """
+    def __init__(self, known_tags: set, fetchers: int = SYNC_CONCURRENCY, priority: int = cr_api.BACKGROUND,
+                 batch_size: int = SYNC_BATCH_SIZE):
+        self.known_tags = known_tags
+        self.fetchers = fetchers
+        self.priority = priority
+        self.users = asyncio.Queue()
+        self.parse_q = asyncio.Queue(maxsize=SYNC_PARSE_QUEUE)
+        self.write_q = asyncio.Queue(maxsize=SYNC_WRITE_QUEUE)
+        self.buffer = MatchBuffer(batch_size)
+
+    async def _put(self, queue: asyncio.Queue, item, stage: Stage):
+        started = time.perf_counter()
+        await queue.put(item)
+        stage.blocked += time.perf_counter() - started
+
+    async def fetch(self):
+        stage = stages["fetch"]
+        while True:
+            try:
+                user = self.users.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            battles = await fetch_battlelog(user, self.priority)
+            stage.busy += time.perf_counter() - started
+            stage.items += 1
+            if battles is None or battles is NOT_FOUND:
+                # Straight to the writer: only the user's retry time changes
+                await self._put(self.write_q, ([], failed_state(user, battles is NOT_FOUND)), stage)
+            else:
+                await self._put(self.parse_q, (user, battles), stage)
+
+    async def parse(self):
+        stage = stages["parse"]
+        while True:
+            item = await self.parse_q.get()
+            if item is None:
+                await self.write_q.put(None)
+                return
+            started = time.perf_counter()
+            try:
+                parsed = read_battlelog(*item, self.known_tags)
+            except Exception as e:
+                print(f"Parse error for {item[0].username}: {e}")
+                continue
+            finally:
+                stage.busy += time.perf_counter() - started
+                stage.items += 1
+            await self._put(self.write_q, parsed, stage)
+
+    async def write(self):
+        stage = stages["write"]
+        done = False
+        while not done:
+            try:
+                item = await asyncio.wait_for(self.write_q.get(), timeout=SYNC_WRITE_LINGER)
+            except asyncio.TimeoutError:
+                item = ()
+            if item is None:
+                done = True
+            elif item:
+                self.buffer.stage(*item)
+                stage.items += 1
+                if not self.buffer.full and not self.write_q.empty():
+                    continue
+            # Flush when full, idle for the linger time, or finished
+            if self.buffer.full or item == () or done:
+                started = time.perf_counter()
+                await asyncio.to_thread(self.buffer.flush)
+                stage.busy += time.perf_counter() - started
+
+    async def run(self, users: list) -> MatchBuffer:
+        for user in users:
+            self.users.put_nowait(user)
+        active.add(self)
+        parser = asyncio.create_task(self.parse())
+        writer = asyncio.create_task(self.write())
+        try:
+            await asyncio.gather(*(self.fetch() for _ in range(min(self.fetchers, len(users)) or 1)))
+            await self.parse_q.put(None)
+            await asyncio.gather(parser, writer)
+        finally:
+            parser.cancel()
+            writer.cancel()
+            active.discard(self)
+        return self.buffer
+
+    def depths(self) -> dict:
+        return {"users": self.users.qsize(), "parse": self.parse_q.qsize(), "write": self.write_q.qsize(),
+                "buffered_rows": len(self.buffer.rows)}
+
+
+def snapshot() -> dict:
+    return {
+        "stages": {name: s.snapshot() for name, s in stages.items()},
+        "queues": [p.depths() for p in active],
+    }
+
+
+async def sync_user_matches(user: models.User, known_tags: set):
+    """Sync a single user right away (manual /sync)."""
+    return await SyncPipeline(known_tags, fetchers=1, priority=cr_api.INTERACTIVE).run([user])
+
+
+async def sync_users(users: list, known_tags: set, concurrency: int = SYNC_CONCURRENCY):
+    """
+    Sync many users through the fetch/parse/write pipeline, pooling their
+    battles into shared multi-row inserts. Returns the buffer so callers
+    can read the totals and per-user states.
+    """
+    return await SyncPipeline(known_tags, fetchers=concurrency).run(users)
@@ -0,0 +1,157 @@
+"""
+Sync worker: `python -m worker`.
+
+Every worker claims sync jobs from the sync_jobs table and runs them
+through the sync pipeline; start as many as the load needs. One of them
+(the advisory-lock leader) also runs the scheduler that queues due users
+and the profile refresher. The API only enqueues (unless SYNC_IN_API=1,
+which runs all of this inside the API process for single-process setups).
+"""
+import os
+import time
+import asyncio
+
+from sqlalchemy import select, update
+
+import models
+import database
+import cr_api
+import crud
+import jobs
+import leader
+import metrics
+import migrate
+import profiles
+import sync
+from known_tags import known_tags
+from scheduler import scheduler
+
+# --- Configuration ---
+# Jobs claimed per pass; they share one pipeline run (and its batched inserts)
+WORKER_BATCH = int(os.getenv("WORKER_BATCH", 50))
+# Seconds between polls when the queue is empty
+WORKER_POLL = float(os.getenv("WORKER_POLL_SECONDS", 1))
+WORKER_HOUSEKEEP = int(os.getenv("WORKER_HOUSEKEEP_SECONDS", 60))
+# Port for a stand-alone /metrics listener (0 = off); the API serves its own.
+# Needs INTERNAL_TOKEN too, which scrapers send as a bearer token.
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 0))
+INTERNAL_TOKEN = os.getenv("INTERNAL_TOKEN", "")
+
+wakeup = asyncio.Event()
+stats = {"batches": 0, "done": 0, "failed": 0}
+
+
+def load_users(user_ids: list) -> list:
+    db = database.SessionLocal()
+    try:
+        users = db.execute(select(models.User).where(models.User.id.in_(user_ids))).scalars().all()
+        # Detach so their attributes stay readable after we close
+        db.expunge_all()
+        return users
+    finally:
+        db.close()
+
+
+def write_profiles(updates: list):
+    db = database.SessionLocal()
+    try:
+        db.execute(update(models.User), updates)
+        crud.bump_friends_version(db, friends_of=[u["id"] for u in updates])
+        db.commit()
+    finally:
+        db.close()
+
+
+async def refresh_profile(user):
+    """Manual syncs also pull the player's profile (name, trophies, clan)."""
+    try:
+        data = await cr_api.get_player(user.player_tag)
+    except cr_api.CRApiError as e:
+        print(f"Profile refresh failed for {user.username}: {e}")
+        return None
+    return profiles.from_player(user, data) if data else None
+
+
+async def run_jobs(claimed: list):
+    started = time.perf_counter()
+    users = {u.id: u for u in await asyncio.to_thread(load_users, [uid for _, uid, _ in claimed])}
+    tags = await asyncio.to_thread(known_tags.current)
+    manual = [users[uid] for _, uid, prio in claimed if prio == cr_api.INTERACTIVE and uid in users]
+    background = [users[uid] for _, uid, prio in claimed if prio != cr_api.INTERACTIVE and uid in users]
+
+    results = await asyncio.gather(
+        sync.SyncPipeline(tags, priority=cr_api.INTERACTIVE).run(manual),
+        sync.SyncPipeline(tags).run(background),
+        *(refresh_profile(u) for u in manual),
+    )
+    states = {**results[0].states, **results[1].states}
+    updates = [u for u in results[2:] if u]
+    if updates:
+        await asyncio.to_thread(write_profiles, updates)
+
+    # No state: the write failed and next_sync_at didn't move; the scheduler retries
+    done = [job_id for job_id, uid, _ in claimed if uid in states and not states[uid].get("sync_failures")]
+    failed = [job_id for job_id, uid, _ in claimed if uid not in states or states[uid].get("sync_failures")]
+    await asyncio.to_thread(jobs.finish, done, failed, "battlelog unavailable")
+    stats["batches"] += 1
+    stats["done"] += len(done)
+    stats["failed"] += len(failed)
+    metrics.sync_batches.inc()
+    metrics.sync_batch_duration.observe(value=time.perf_counter() - started)
+    metrics.sync_users.inc("synced", amount=len(done))
+    metrics.sync_users.inc("failed", amount=len(failed))
+    metrics.sync_matches.inc("inserted", amount=results[0].inserted + results[1].inserted)
+    metrics.sync_matches.inc("duplicate", amount=results[0].duplicates + results[1].duplicates)
+
+
+async def consume():
+    housekept = 0.0
+    while True:
+        try:
+            if time.monotonic() - housekept >= WORKER_HOUSEKEEP:
+                await asyncio.to_thread(jobs.housekeep)
+                housekept = time.monotonic()
+            claimed = await asyncio.to_thread(jobs.claim, WORKER_BATCH)
+            if claimed:
+                await run_jobs(claimed)
+                continue
+        except Exception as e:
+            print(f"Worker error: {e}")
+
+        wakeup.clear()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=WORKER_POLL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def leader_jobs():
+    await asyncio.gather(scheduler.run(), profiles.refresher.run())
+
+
+async def run():
+    await asyncio.gather(leader.run_as_leader(leader_jobs), consume())
+
+
+def pipeline_depths():
+    depths = {}
+    for pipeline in sync.active:
+        for queue, depth in pipeline.depths().items():
+            depths[(queue,)] = depths.get((queue,), 0) + depth
+    return depths
+
+metrics.Gauge("sync_queue_depth", "Items waiting in running sync pipelines, per queue", ("queue",), pipeline_depths)
+
+
+def snapshot() -> dict:
+    return dict(stats)
+
+
+if __name__ == "__main__":
+    # Postgres deploys run `python migrate.py` first (the Docker entrypoint does)
+    if database.engine.dialect.name == "sqlite":
+        migrate.run()
+    print(f"🛠️ Sync worker started (pid {os.getpid()})")
+    if WORKER_METRICS_PORT and INTERNAL_TOKEN:
+        metrics.serve(WORKER_METRICS_PORT, INTERNAL_TOKEN)
+    asyncio.run(run())
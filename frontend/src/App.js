@@ -56,6 +56,11 @@ function App() {
   };
 
   const handleLinkSuccess = (updatedUser) => {
+    // Tokens may carry the player tag; the server re-issues one after linking
+    if (updatedUser.access_token) {
+      localStorage.setItem('clash_token', updatedUser.access_token);
+      setToken(updatedUser.access_token);
+    }
     setUser(updatedUser);
   };
 
@@ -13,6 +13,23 @@ const client = axios.create({
 
 const getAuthHeader = (token) => ({ Authorization: `Bearer ${token}` });
 
+// Last ETag and body per URL: unchanged listings come back as an empty 304
+const validators = new Map();
+
+const cachedGet = async (url, token) => {
+  const cached = validators.get(url);
+  const headers = getAuthHeader(token);
+  if (cached) headers['If-None-Match'] = cached.etag;
+
+  const response = await client.get(url, {
+    headers,
+    validateStatus: (status) => (status >= 200 && status < 300) || status === 304,
+  });
+  if (response.status === 304 && cached) return cached.data;
+  if (response.headers.etag) validators.set(url, { etag: response.headers.etag, data: response.data });
+  return response.data;
+};
+
 export const api = {
   // userData: { email, password, invite_token, player_tag }
   signup: async (userData) => {
@@ -86,10 +103,27 @@ export const api = {
   },
 
   getMatches: async (playerTag, token) => {
-    const response = await client.get(`/matches`, { headers: getAuthHeader(token) });
+    return cachedGet('/matches', token);
+  },
+
+  // Full history as a file download; format is 'csv' or 'ndjson'
+  exportMatches: async (token, format = 'csv') => {
+    const response = await client.get(`/matches/export?format=${format}`, {
+      headers: getAuthHeader(token),
+      responseType: 'blob',
+    });
     return response.data;
   },
 
+  // Profile, friend standings and recent matches in one request
+  getDashboard: async (token) => {
+    return cachedGet('/dashboard', token);
+  },
+
+  getH2H: async (token) => {
+    return cachedGet('/h2h', token);
+  },
+
   syncBattles: async (playerTag, token) => {
     const cleanTag = playerTag.replace('#', '');
     const response = await client.post(`/sync/${cleanTag}`, {}, {
@@ -98,13 +132,24 @@ export const api = {
     return response.data;
   },
 
-  getFriends: async (userId, token) => {
-    const response = await client.get(`/users/${userId}/friends`, {
-      headers: getAuthHeader(token)
-    });
+  // Server push of newly synced battles ('match' and 'resync' events).
+  // EventSource can't send headers, so the URL carries a short-lived ticket,
+  // never the access token. Every (re)connect needs a fresh one.
+  openEvents: async (token) => {
+    const response = await client.post('/events/ticket', {}, { headers: getAuthHeader(token) });
+    return new EventSource(`${API_URL}/events?ticket=${encodeURIComponent(response.data.ticket)}`);
+  },
+
+  // Sync runs in the background; poll the job until it's done or failed
+  getSyncJob: async (jobId, token) => {
+    const response = await client.get(`/sync/jobs/${jobId}`, { headers: getAuthHeader(token) });
     return response.data;
   },
 
+  getFriends: async (userId, token) => {
+    return cachedGet(`/users/${userId}/friends`, token);
+  },
+
   forgotPassword: async (email) => {
       const response = await client.post('/auth/forgot-password', { email });
       return response.data;
@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { UserPlus, RefreshCw, LogOut } from 'lucide-react';
 import StatCard from '../components/StatCard';
 import Leaderboard from '../components/Leaderboard';
@@ -9,8 +9,7 @@ import FeedbackModal from '../components/FeedbackModal';
 import { api } from '../api/clash';
 
 const Dashboard = ({ user, token, onLogout }) => {
-  const [matches, setMatches] = useState([]);
-  const [friends, setFriends] = useState([]);
+  const [standings, setStandings] = useState([]);
   const [loading, setLoading] = useState(true);
   const [syncing, setSyncing] = useState(false);
   const [isSearchOpen, setIsSearchOpen] = useState(false);
@@ -21,14 +20,9 @@ const Dashboard = ({ user, token, onLogout }) => {
 
   const fetchData = useCallback(async () => {
     try {
-      const [matchData, friendData, userData] = await Promise.all([
-        api.getMatches(user.player_tag, token),
-        api.getFriends(user.id, token),
-        api.getMe(token)
-      ]);
-      setMatches(matchData);
-      setFriends(friendData);
-      setCurrentUser(userData);
+      const data = await api.getDashboard(token);
+      setStandings(data.standings);
+      setCurrentUser(data.profile);
     } catch (err) {
       console.error("Fetch error:", err);
       // ADD THIS: Logout if token is invalid
@@ -38,20 +32,82 @@ const Dashboard = ({ user, token, onLogout }) => {
     } finally {
       setLoading(false);
     }
-  }, [user.player_tag, user.id, token, onLogout]);
+  }, [token, onLogout]);
 
   useEffect(() => { fetchData(); }, [fetchData]);
 
+  // New battles are pushed as they're synced; refetch (ETag-cheap) once a burst settles
+  const liveRef = useRef(false);
+  useEffect(() => {
+    if (!user.player_tag || typeof EventSource === 'undefined') return undefined;
+    let source;
+    let timer;
+    let retry;
+    let closed = false;
+    const refresh = () => {
+      clearTimeout(timer);
+      timer = setTimeout(fetchData, 500);
+    };
+    // Tickets are single-use in practice (short-lived), so reconnect by hand with a new one
+    const connect = async () => {
+      try {
+        source = await api.openEvents(token);
+      } catch (err) {
+        if (!closed) retry = setTimeout(connect, 5000);
+        return;
+      }
+      if (closed) { source.close(); return; }
+      source.onopen = () => { liveRef.current = true; };
+      source.onerror = () => {
+        liveRef.current = false;
+        source.close();
+        if (!closed) retry = setTimeout(connect, 5000);
+      };
+      source.addEventListener('match', refresh);
+      source.addEventListener('resync', refresh);
+    };
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(timer);
+      clearTimeout(retry);
+      liveRef.current = false;
+      if (source) source.close();
+    };
+  }, [token, user.player_tag, fetchData]);
+
   const handleSync = async () => {
     setSyncing(true);
     try {
-      await api.syncBattles(user.player_tag);
+      let job = await api.syncBattles(user.player_tag, token);
+      // With the event stream open, new battles arrive on their own
+      if (liveRef.current) return;
+      for (let i = 0; i < 30 && (job.status === 'queued' || job.status === 'running'); i++) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        job = await api.getSyncJob(job.id, token);
+      }
       await fetchData();
+    } catch (err) {
+      console.error("Sync error:", err);
     } finally {
       setSyncing(false);
     }
   };
 
+  const handleExport = async () => {
+    try {
+      const blob = await api.exportMatches(token, 'csv');
+      const url = URL.createObjectURL(blob);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `matches-${(currentUser.player_tag || '').replace('#', '')}.csv`;
+      link.click();
+      URL.revokeObjectURL(url);
+    } catch (err) {
+      console.error("Export error:", err);
+    }
+  };
+
   return (
     <div className="min-h-screen bg-slate-900 text-slate-100">
       <BetaBanner onOpenFeedback={() => setIsFeedbackOpen(true)} />
@@ -91,8 +147,11 @@ const Dashboard = ({ user, token, onLogout }) => {
             
             <div className="bg-blue-900/10 border border-blue-500/20 rounded-xl p-4 text-center">
                 <p className="text-blue-400 text-sm">
-                    Battle data is synced every 30 minutes. 
+                    Battle data syncs automatically, more often while you battle friends.
                     <button onClick={handleSync} className="underline ml-1 hover:text-blue-300">Sync now</button>
+                    {currentUser.player_tag && (
+                      <button onClick={handleExport} className="underline ml-3 hover:text-blue-300">Download history (CSV)</button>
+                    )}
                 </p>
             </div>
           </div>
@@ -106,7 +165,7 @@ const Dashboard = ({ user, token, onLogout }) => {
               <UserPlus className="w-5 h-5" /> Add Friend
             </button>
             
-            <Leaderboard matches={matches} friends={friends} playerTag={user.player_tag} />
+            <Leaderboard standings={standings} />
           </div>
         </div>
       </main>
@@ -0,0 +1,92 @@
+"""
+Local stand-in for the RoyaleAPI proxy, for exercising sync and the CR API
+budget without spending real quota.
+
+    python stub_cr_api.py --port 8081 --rate 5
+    CR_API_BASE=http://localhost:8081/v1 CR_API_KEY=stub uvicorn main:app
+
+Every player exists (except tags containing "NOPE") and is in #STUBCLAN,
+whose member list holds the fixed TAGS. Players battle each other at
+random, and requests over --rate per second get a 429 with Retry-After.
+"""
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+ARGS = None
+WINDOW = {"start": time.monotonic(), "count": 0}
+TAGS = ["#9GLG0JGL0", "#2U9YPQJ82", "#YJLQJ28JC", "#9LQ2U980V"]
+
+
+def battlelog(tag):
+    now = datetime.now(timezone.utc)
+    battles = []
+    for i in range(25):
+        opp = random.choice([t for t in TAGS if t != tag] + ["#RANDOM1", "#RANDOM2"])
+        t = (now - timedelta(minutes=7 * i + random.randint(0, 3))).strftime("%Y%m%dT%H%M%S.000Z")
+        battles.append({
+            "battleTime": t,
+            "type": random.choice(["PvP", "friendly", "pathOfLegend"]),
+            "team": [{"tag": tag, "crowns": random.randint(0, 3)}],
+            "opponent": [{"tag": opp, "crowns": random.randint(0, 3)}],
+        })
+    return battles
+
+
+class Handler(BaseHTTPRequestHandler):
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        # Fixed one-second window rate limit, like the real proxy's behaviour under load
+        now = time.monotonic()
+        if now - WINDOW["start"] >= 1:
+            WINDOW["start"], WINDOW["count"] = now, 0
+        WINDOW["count"] += 1
+        if ARGS.rate and WINDOW["count"] > ARGS.rate:
+            return self.send_json(429, {"reason": "requestThrottled"}, {"Retry-After": str(ARGS.retry_after)})
+
+        time.sleep(ARGS.latency / 1000)
+        parts = unquote(self.path).split("/")  # ['', 'v1', 'players', '#TAG', ('battlelog')]
+        if len(parts) < 4 or parts[2] not in ("players", "clans"):
+            return self.send_json(404, {"reason": "notFound"})
+        tag = parts[3]
+        if "NOPE" in tag:
+            return self.send_json(404, {"reason": "notFound"})
+
+        if parts[2] == "players" and parts[-1] == "battlelog":
+            return self.send_json(200, battlelog(tag))
+        if parts[2] == "players":
+            return self.send_json(200, {"tag": tag, "name": f"Stub {tag[1:5]}", "trophies": random.randint(5000, 9000),
+                                        "clan": {"tag": "#STUBCLAN", "name": "Stub Clan"}})
+        if parts[2] == "clans" and len(parts) == 4:
+            return self.send_json(200, {"tag": tag, "name": "Stub Clan", "memberList": [
+                {"tag": t, "name": f"Stub {t[1:5]}", "trophies": random.randint(5000, 9000)} for t in TAGS]})
+        return self.send_json(404, {"reason": "notFound"})
+
+    def log_message(self, fmt, *args):
+        if ARGS.verbose:
+            super().log_message(fmt, *args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate", type=int, default=0, help="requests/sec before 429 (0 = unlimited)")
+    parser.add_argument("--retry-after", type=int, default=3)
+    parser.add_argument("--latency", type=int, default=50, help="ms added to every response")
+    parser.add_argument("--verbose", action="store_true")
+    ARGS = parser.parse_args()
+    print(f"🧪 Stub CR API on http://localhost:{ARGS.port}/v1")
+    ThreadingHTTPServer(("", ARGS.port), Handler).serve_forever()
@@ -0,0 +1,111 @@
+"""
+Shared fixtures. Run from the repo root with `python -m pytest`.
+
+Backend modules read their configuration at import, so the environment is
+set here, before any test module imports them.
+"""
+import os
+import sys
+import socket
+import subprocess
+import tempfile
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+STUB_PORT = _free_port()
+STUB_RETRY_AFTER = 1
+
+os.environ["CR_API_BASES"] = f"http://127.0.0.1:{STUB_PORT}/v1"
+os.environ["CR_API_KEY"] = "stub"
+# A throwaway SQLite database, emptied after every test; no sync worker in the API
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='clash-tests-'), 'test.db')}"
+os.environ["SYNC_IN_API"] = "0"
+
+
+@pytest.fixture(scope="session")
+def stub_cr_api():
+    """stub_cr_api.py on STUB_PORT, allowing 1 request/sec before it answers 429."""
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "stub_cr_api.py"), "--port", str(STUB_PORT),
+         "--rate", "1", "--retry-after", str(STUB_RETRY_AFTER), "--latency", "0"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", STUB_PORT), timeout=0.2).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("stub_cr_api.py didn't start")
+                time.sleep(0.05)
+        yield os.environ["CR_API_BASES"]
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+@pytest.fixture(scope="session")
+def schema():
+    import migrate
+    migrate.run()
+
+
+@pytest.fixture
+def db(schema):
+    """A session on the test database; every table is emptied afterwards."""
+    import database
+    import models
+    session = database.SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        with database.engine.begin() as conn:
+            for table in reversed(models.Base.metadata.sorted_tables):
+                conn.execute(table.delete())
+
+
+@pytest.fixture(scope="session")
+def app_client(schema):
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture
+def client(app_client, db):
+    """The API, with its per-process caches cleared after each test (row ids get reused)."""
+    import main
+    yield app_client
+    for cache in (main.principals, main.recent_writers, main.dashboards):
+        cache.entries.clear()
+
+
+@pytest.fixture
+def make_user(db):
+    """Create a user with a linked tag; returns (user, auth headers)."""
+    import main
+    import models
+
+    def make(tag: str, email: str = None):
+        user = models.User(username=tag, player_tag=tag, email=email or f"{tag.lstrip('#').lower()}@example.com",
+                           hashed_password="x")
+        db.add(user)
+        db.commit()
+        token = main.create_token(main.token_claims(user))
+        return user, {"Authorization": f"Bearer {token}"}
+    return make
@@ -0,0 +1,73 @@
+"""The CR API budget against stub_cr_api.py: 429 handling and caller priority."""
+import time
+import asyncio
+
+import pytest
+
+import cr_api
+from cr_api import INTERACTIVE, BACKGROUND, ApiBudget, RateLimited
+from conftest import STUB_RETRY_AFTER
+
+
+@pytest.fixture
+def budget(monkeypatch, stub_cr_api):
+    # A fresh bucket per test; its asyncio.Condition binds to that test's loop
+    b = ApiBudget(rate=5, capacity=2, reserve=1)
+    monkeypatch.setattr(cr_api, "budget", b)
+    return b
+
+
+async def _force_429():
+    """Call the stub until it throttles (its limit is 1 request/sec)."""
+    try:
+        for _ in range(5):
+            try:
+                await cr_api.get_player("#2U9YPQJ82", priority=BACKGROUND)
+            except RateLimited as e:
+                return e
+        raise AssertionError("stub never answered 429")
+    finally:
+        await cr_api.close_client()
+
+
+def test_429_pauses_every_caller(budget):
+    async def run():
+        err = await _force_429()
+        assert err.retry_after == STUB_RETRY_AFTER
+
+        snap = budget.snapshot()
+        assert snap["rate_limited"] == 1
+        assert snap["statuses"][429] == 1
+        assert snap["tokens"] < 1
+        assert 0 < snap["paused_for"] <= STUB_RETRY_AFTER
+
+        # Interactive callers can't wait out the pause within their timeout
+        with pytest.raises(RateLimited):
+            await budget.acquire(INTERACTIVE, max_wait=0.1)
+
+        started = time.monotonic()
+        await budget.acquire(BACKGROUND)
+        assert time.monotonic() - started >= snap["paused_for"] - 0.05
+
+    asyncio.run(run())
+
+
+def test_interactive_goes_before_background(budget):
+    async def run():
+        await _force_429()
+        order = []
+
+        async def caller(name, priority):
+            await budget.acquire(priority)
+            order.append(name)
+
+        # Background callers queue first, then an interactive one arrives
+        tasks = [asyncio.create_task(caller(f"background-{i}", BACKGROUND)) for i in range(3)]
+        await asyncio.sleep(0.05)
+        tasks.append(asyncio.create_task(caller("interactive", INTERACTIVE)))
+        await asyncio.wait_for(asyncio.gather(*tasks), timeout=STUB_RETRY_AFTER + 5)
+
+        assert order[0] == "interactive"
+        assert sorted(order[1:]) == ["background-0", "background-1", "background-2"]
+
+    asyncio.run(run())
@@ -0,0 +1,120 @@
+"""Conditional GETs: ETags change after writes, and only then."""
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import event
+
+import crud
+import database
+import main
+import models
+import sync
+
+
+@pytest.fixture
+def me(make_user):
+    return make_user("#AAA")
+
+
+def ingest(*battles):
+    """Write battles through the sync writer, as a worker would."""
+    buffer = sync.MatchBuffer()
+    buffer.add([sync.parse_battle(b, {"#AAA", "#BBB", "#CCC"}) for b in battles])
+    buffer.flush()
+
+
+def battle(tag: str, opponent: str, at: datetime):
+    return {"battleTime": at.strftime("%Y%m%dT%H%M%S.000Z"),
+            "team": [{"tag": tag, "crowns": 2}], "opponent": [{"tag": opponent, "crowns": 1}]}
+
+
+def get(client, path, headers, etag=None):
+    return client.get(path, headers={**headers, "If-None-Match": etag} if etag else headers)
+
+
+def test_unchanged_list_is_not_modified(client, me):
+    _, headers = me
+    first = get(client, "/matches", headers)
+    assert first.status_code == 200
+    again = get(client, "/matches", headers, first.headers["etag"])
+    assert again.status_code == 304
+    assert again.content == b""
+    # A different query is a different listing
+    assert get(client, "/matches?limit=5", headers, first.headers["etag"]).status_code == 200
+
+
+def test_ingested_battle_invalidates_matches_and_dashboard(client, db, me, make_user):
+    _, headers = me
+    make_user("#BBB")
+    matches = get(client, "/matches", headers).headers["etag"]
+    dashboard = get(client, "/dashboard", headers).headers["etag"]
+
+    ingest(battle("#AAA", "#BBB", datetime.now(timezone.utc)))
+
+    r = get(client, "/matches", headers, matches)
+    assert r.status_code == 200
+    assert [m["player_2_tag"] for m in r.json()] == ["#BBB"]
+    assert get(client, "/dashboard", headers, dashboard).status_code == 200
+
+
+def test_battles_of_others_leave_etag_alone(client, me, make_user):
+    _, headers = me
+    make_user("#BBB")
+    make_user("#CCC")
+    etag = get(client, "/matches", headers).headers["etag"]
+    ingest(battle("#BBB", "#CCC", datetime.now(timezone.utc)))
+    assert get(client, "/matches", headers, etag).status_code == 304
+
+
+def test_friend_changes_invalidate_friend_list(client, db, me, make_user):
+    user, headers = me
+    friend, _ = make_user("#BBB")
+    path = f"/users/{user.id}/friends"
+    etag = get(client, path, headers).headers["etag"]
+
+    assert client.post("/friends/add", json={"user_id_2": friend.id}, headers=headers).status_code == 200
+    r = get(client, path, headers, etag)
+    assert r.status_code == 200
+    assert [u["player_tag"] for u in r.json()] == ["#BBB"]
+    etag = r.headers["etag"]
+
+    # A friend's profile refresh shows up on this user's list
+    db.execute(models.User.__table__.update().where(models.User.id == friend.id).values(username="renamed"))
+    crud.bump_friends_version(db, friends_of=[friend.id])
+    db.commit()
+    r = get(client, path, headers, etag)
+    assert r.status_code == 200
+    assert [u["username"] for u in r.json()] == ["renamed"]
+
+
+def test_link_tag_invalidates_match_list(client, db, me, make_user, monkeypatch):
+    user, headers = me
+    make_user("#BBB")
+    ingest(battle("#CCC", "#BBB", datetime.now(timezone.utc)))
+    etag = get(client, "/matches", headers).headers["etag"]
+    monkeypatch.setattr(main, "fetch_cr_player", lambda tag: {"name": "Relinked", "trophies": 1})
+
+    assert client.put("/users/link-tag", json={"player_tag": "#CCC"}, headers=headers).status_code == 200
+
+    r = get(client, "/matches", headers, etag)
+    assert r.status_code == 200
+    assert [m["player_1_tag"] for m in r.json()] == ["#CCC"]
+    db.expire_all()
+    assert db.get(models.User, user.id).matches_version == 1
+
+
+def test_dashboard_is_one_query(client, me):
+    _, headers = me
+    etag = get(client, "/dashboard", headers).headers["etag"] # Also warms the principal cache
+    main.dashboards.entries.clear()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", listener)
+    try:
+        assert get(client, "/dashboard", headers).headers["etag"] == etag
+        main.dashboards.entries.clear()
+        assert get(client, "/dashboard", headers, etag).status_code == 304
+    finally:
+        event.remove(database.async_engine.sync_engine, "before_cursor_execute", listener)
+    assert len(statements) == 2
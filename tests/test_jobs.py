@@ -0,0 +1,124 @@
+"""Sync job queue: one active job per user, claiming, and retries of failed syncs."""
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import cr_api
+import database
+import jobs
+import main
+import models
+import sync
+import worker
+from scheduler import SyncScheduler
+
+
+def run_queued(db, user_ids):
+    jobs.enqueue_many(db, user_ids)
+    asyncio.run(worker.run_jobs(jobs.claim(10)))
+    db.expire_all()
+
+
+@pytest.fixture
+def battlelogs(monkeypatch):
+    """Stand-in CR API: tag -> battlelog list, None (404) or an exception to raise."""
+    logs = {}
+
+    async def get_battlelog(tag, priority=cr_api.BACKGROUND):
+        result = logs[tag]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    monkeypatch.setattr(cr_api, "get_battlelog", get_battlelog)
+    return logs
+
+
+def test_failed_syncs_back_off(db, make_user, battlelogs):
+    user, _ = make_user("#AAA")
+    battlelogs["#AAA"] = cr_api.CRApiError("upstream down")
+
+    delays = []
+    for _ in range(3):
+        started = datetime.now(timezone.utc)
+        run_queued(db, [user.id])
+        delays.append((sync.as_utc(db.get(models.User, user.id).next_sync_at) - started).total_seconds())
+    assert db.get(models.User, user.id).sync_failures == 3
+    assert [round(d / sync.SYNC_RETRY_INTERVAL) for d in delays] == [1, 2, 4]
+    assert db.query(models.SyncJob).filter_by(status="failed").count() == 3
+
+    # Recovery clears the failure count
+    battlelogs["#AAA"] = []
+    run_queued(db, [user.id])
+    assert db.get(models.User, user.id).sync_failures == 0
+
+
+def test_missing_tag_is_parked_until_relinked(client, db, make_user, battlelogs, monkeypatch):
+    user, headers = make_user("#AAA")
+    battlelogs["#AAA"] = None
+    run_queued(db, [user.id])
+    assert db.get(models.User, user.id).sync_parked_at is not None
+
+    scheduler = SyncScheduler()
+    scheduler.reload()
+    assert user.id not in scheduler.due
+
+    monkeypatch.setattr(main, "fetch_cr_player", lambda tag: {"name": "Relinked"})
+    assert client.put("/users/link-tag", json={"player_tag": "#BBB"}, headers=headers).status_code == 200
+    scheduler.reload()
+    assert user.id in scheduler.due
+
+
+def test_manual_sync_is_limited_to_self_and_friends(client, db, make_user):
+    me, headers = make_user("#AAA")
+    friend, _ = make_user("#BBB")
+    make_user("#CCC")
+    db.add(models.Friendship(user_id_1=me.id, user_id_2=friend.id))
+    db.commit()
+
+    assert client.post("/sync/AAA").status_code == 401
+    assert client.post("/sync/CCC", headers=headers).status_code == 404
+
+    own = client.post("/sync/AAA", headers=headers)
+    assert own.status_code == 202
+    theirs = client.post("/sync/BBB", headers=headers)
+    assert theirs.status_code == 202
+    assert client.get(f"/sync/jobs/{theirs.json()['id']}", headers=headers).status_code == 200
+    # Per-tag cooldown
+    assert client.post("/sync/AAA", headers=headers).status_code == 429
+
+
+async def enqueue(user_id, priority):
+    async with database.AsyncSessionLocal() as session:
+        return (await jobs.enqueue(session, user_id, priority)).id
+
+
+def test_one_active_job_per_user(db, make_user):
+    user, _ = make_user("#AAA")
+    other, _ = make_user("#BBB")
+
+    assert jobs.enqueue_many(db, [user.id]) == 1
+    # Already queued: nothing new, for either path
+    assert jobs.enqueue_many(db, [user.id, other.id]) == 1
+    first = asyncio.run(enqueue(user.id, cr_api.INTERACTIVE))
+    assert asyncio.run(enqueue(user.id, cr_api.INTERACTIVE)) == first
+    # The manual request overtook the scheduled job's priority
+    job = db.get(models.SyncJob, first)
+    assert job.priority == cr_api.INTERACTIVE
+
+    # The partial unique index itself rejects a second active row
+    db.add(models.SyncJob(user_id=user.id, priority=cr_api.BACKGROUND, status="queued"))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+
+    claimed = jobs.claim(10)
+    assert [(uid, prio) for _, uid, prio in claimed] == [(user.id, cr_api.INTERACTIVE), (other.id, cr_api.BACKGROUND)]
+    assert jobs.claim(10) == []
+    # Running counts as active too
+    assert asyncio.run(enqueue(user.id, cr_api.INTERACTIVE)) == first
+
+    jobs.finish([first], [])
+    assert asyncio.run(enqueue(user.id, cr_api.INTERACTIVE)) != first
+    assert db.query(models.SyncJob).filter(models.SyncJob.status.in_(jobs.ACTIVE)).count() == 2
@@ -0,0 +1,67 @@
+"""Keyset pagination of GET /matches: (battle_time, id) order across both sides of a match."""
+from datetime import datetime, timedelta
+
+import models
+
+
+def add_matches(db, *specs):
+    """(player_1, player_2, minutes ago) per match; returns their battle_ids in insert (= id) order."""
+    base = datetime(2024, 1, 1, 12, 0)
+    ids = []
+    for i, (p1, p2, minutes_ago) in enumerate(specs):
+        battle_id = f"m{i}"
+        db.add(models.Match(battle_id=battle_id, player_1_tag=p1, player_2_tag=p2, winner_tag=p1,
+                            battle_time=base - timedelta(minutes=minutes_ago), game_mode="PvP",
+                            crowns_1=1, crowns_2=0))
+        db.flush()
+        ids.append(battle_id)
+    db.commit()
+    return ids
+
+
+def all_pages(client, headers, limit, **params):
+    seen, cursor, pages = [], None, 0
+    while True:
+        r = client.get("/matches", headers=headers, params={"limit": limit, **params, **({"cursor": cursor} if cursor else {})})
+        assert r.status_code == 200
+        seen += [m["battle_id"] for m in r.json()]
+        pages += 1
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            return seen, pages
+
+
+def test_pages_are_newest_first_with_ties_broken_by_id(client, db, make_user):
+    _, headers = make_user("#AAA")
+    # m1, m2, m3 share a battle_time, and sides alternate
+    ids = add_matches(db,
+        ("#AAA", "#BBB", 5),
+        ("#BBB", "#AAA", 3), ("#AAA", "#CCC", 3), ("#CCC", "#AAA", 3),
+        ("#AAA", "#BBB", 1),
+        ("#BBB", "#CCC", 2), # Not #AAA's
+        ("#AAA", "#CCC", 9),
+    )
+    assert ids == [f"m{i}" for i in range(7)]
+    expected = ["m4", "m3", "m2", "m1", "m0", "m6"]
+
+    for limit in (1, 2, 4, 6, 50):
+        seen, pages = all_pages(client, headers, limit)
+        assert seen == expected
+        # A full last page still hands out a cursor, which then yields an empty page
+        assert pages == len(expected) // limit + 1
+
+
+def test_pages_with_opponent_filter(client, db, make_user):
+    _, headers = make_user("#AAA")
+    add_matches(db, ("#AAA", "#BBB", 1), ("#CCC", "#AAA", 2), ("#BBB", "#AAA", 2), ("#AAA", "#BBB", 3))
+    seen, _ = all_pages(client, headers, 1, opponent="BBB")
+    assert seen == ["m0", "m2", "m3"]
+
+
+def test_bad_cursor_is_400(client, make_user):
+    _, headers = make_user("#AAA")
+    # Not base64, base64 of no "|", a bad timestamp
+    for cursor in ("%%%", "bm90LWEtY3Vyc29y", "eWVzdGVyZGF5fDE"):
+        r = client.get("/matches", headers=headers, params={"cursor": cursor})
+        assert r.status_code == 400
+        assert r.json()["detail"] == "Invalid cursor"
@@ -0,0 +1,63 @@
+"""Per-user sync state: the watermark, idle count and next sync time written after each sync."""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import event
+
+import database
+import models
+import sync
+
+TAGS = {"#AAA", "#BBB"}
+
+
+def battle(minutes_ago: int):
+    t = datetime.now(timezone.utc) - timedelta(minutes=minutes_ago)
+    return {"battleTime": t.strftime("%Y%m%dT%H%M%S.000Z"),
+            "team": [{"tag": "#AAA", "crowns": 1}], "opponent": [{"tag": "#ZZZ", "crowns": 0}]}
+
+
+def sync_once(db, user_id, battles):
+    """One sync of `battles` for the user; returns the UPDATE statements it ran on users."""
+    user = db.get(models.User, user_id)
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(database.engine, "before_cursor_execute", listener)
+    try:
+        buffer = sync.MatchBuffer()
+        buffer.add(*sync.read_battlelog(user, battles, TAGS))
+        buffer.flush()
+    finally:
+        event.remove(database.engine, "before_cursor_execute", listener)
+    db.expire_all()
+    return [s for s in statements if s.startswith("UPDATE users")]
+
+
+def set_columns(statement: str) -> set:
+    assignments = statement.split(" SET ", 1)[1].split(" WHERE ", 1)[0]
+    return {a.split("=")[0].strip() for a in assignments.split(",")}
+
+
+def test_idle_sync_only_moves_idle_count_and_next_sync(db, make_user):
+    user, _ = make_user("#AAA")
+    battles = [battle(5), battle(10)]
+    sync_once(db, user.id, battles)
+    synced = db.get(models.User, user.id)
+    watermark, synced_at = synced.last_battle_time, synced.last_synced_at
+    assert synced.idle_syncs == 0
+
+    for n in (1, 2):
+        updates = sync_once(db, user.id, battles) # Nothing newer than the watermark
+        assert len(updates) == 1
+        assert set_columns(updates[0]) == {"idle_syncs", "next_sync_at"}
+        user = db.get(models.User, user.id)
+        assert user.idle_syncs == n
+        assert (user.last_battle_time, user.last_synced_at) == (watermark, synced_at)
+
+    # Idle syncs back off
+    delay = sync.as_utc(user.next_sync_at) - datetime.now(timezone.utc)
+    assert delay > timedelta(seconds=sync.SYNC_INTERVAL * 3)
+
+    sync_once(db, user.id, [battle(1)] + battles)
+    user = db.get(models.User, user.id)
+    assert user.idle_syncs == 0
+    assert user.last_battle_time > watermark
@@ -0,0 +1,113 @@
+"""TTLCache: coalesced loads, negative caching, stale-while-revalidate."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=c))
+    return c
+
+
+def make_cache(results: dict, calls: list):
+    async def loader(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        result = results[key]
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return cache.TTLCache(loader, ttl=60, stale_ttl=60, negative_ttl=10, max_size=100)
+
+
+def test_concurrent_misses_share_one_load(clock):
+    calls = []
+    c = make_cache({"#A": {"name": "A"}}, calls)
+
+    async def run():
+        return await asyncio.gather(*(c.get("#A") for _ in range(5)))
+
+    assert asyncio.run(run()) == [{"name": "A"}] * 5
+    assert calls == ["#A"]
+    assert (c.stats["misses"], c.stats["coalesced"]) == (1, 4)
+
+
+def test_unknown_keys_are_cached_for_negative_ttl(clock):
+    calls = []
+    c = make_cache({"#NOPE": None}, calls)
+
+    async def run():
+        assert await c.get("#NOPE") is None
+        clock.now += 9
+        assert await c.get("#NOPE") is None
+        clock.now += 2 # Past negative_ttl: ask upstream again
+        assert await c.get("#NOPE") is None
+
+    asyncio.run(run())
+    assert calls == ["#NOPE", "#NOPE"]
+    assert c.stats["negative_hits"] == 1
+
+
+def test_stale_value_is_served_while_one_refresh_runs(clock):
+    calls = []
+    results = {"#A": 1}
+    c = make_cache(results, calls)
+
+    async def run():
+        assert await c.get("#A") == 1
+        clock.now += 61
+        results["#A"] = 2
+        assert await c.get("#A") == 1 # Stale, refresh started
+        assert await c.get("#A") == 1 # Refresh already running
+        await asyncio.sleep(0.05)
+        assert await c.get("#A") == 2
+
+    asyncio.run(run())
+    assert calls == ["#A", "#A"]
+    assert c.stats["stale_hits"] == 2
+
+
+def test_errors_are_not_cached(clock):
+    calls = []
+    results = {"#A": RuntimeError("upstream down")}
+    c = make_cache(results, calls)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await c.get("#A")
+        results["#A"] = 1
+        assert await c.get("#A") == 1
+
+    asyncio.run(run())
+    assert calls == ["#A", "#A"]
+    assert c.stats["errors"] == 1
+
+
+def test_cancelled_caller_does_not_cancel_shared_load(clock):
+    calls = []
+    c = make_cache({"#A": 1}, calls)
+
+    async def run():
+        first = asyncio.create_task(c.get("#A"))
+        second = asyncio.create_task(c.get("#A"))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == 1
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(run())
+    assert calls == ["#A"]
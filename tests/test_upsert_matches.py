@@ -0,0 +1,46 @@
+"""Bulk match ingestion: duplicates (within a batch, across batches) are inserted once and reported."""
+from datetime import datetime, timedelta, timezone
+
+import crud
+import models
+import sync
+
+
+def row(n: int, p1="#AAA", p2="#BBB"):
+    t = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=n)
+    return {"battle_id": sync.generate_battle_id(t, p1, p2), "player_1_tag": p1, "player_2_tag": p2,
+            "winner_tag": p1, "battle_time": t, "game_mode": "PvP", "crowns_1": 1, "crowns_2": 0}
+
+
+def test_returns_only_new_battle_ids(db, monkeypatch):
+    monkeypatch.setattr(crud, "UPSERT_CHUNK_SIZE", 2) # Several statements per call
+    first = [row(i) for i in range(5)]
+    assert crud.upsert_matches(db, first) == {r["battle_id"] for r in first}
+    db.commit()
+
+    # Three already stored, two new, and one new battle listed twice
+    second = first[:3] + [row(5), row(6), row(6)]
+    assert crud.upsert_matches(db, second) == {row(5)["battle_id"], row(6)["battle_id"]}
+    db.commit()
+    assert db.query(models.Match).count() == 7
+
+
+def test_both_players_reporting_a_battle_count_once(db, make_user):
+    make_user("#AAA")
+    make_user("#BBB")
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    battle = {"battleTime": now.strftime("%Y%m%dT%H%M%S.000Z"),
+              "team": [{"tag": "#AAA", "crowns": 3}], "opponent": [{"tag": "#BBB", "crowns": 0}]}
+    mirrored = {**battle, "team": battle["opponent"], "opponent": battle["team"]}
+    tags = {"#AAA", "#BBB"}
+
+    buffer = sync.MatchBuffer()
+    buffer.add([sync.parse_battle(battle, tags), sync.parse_battle(mirrored, tags)])
+    buffer.flush()
+    buffer.add([sync.parse_battle(battle, tags)]) # Next sync sees it again
+    buffer.flush()
+
+    assert (buffer.inserted, buffer.duplicates) == (1, 2)
+    assert db.query(models.Match).count() == 1
+    rivalry = db.query(models.Rivalry).one()
+    assert (rivalry.wins_a, rivalry.wins_b) == (1, 0) # Counted once in the H2H totals too